@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+#Benchmark/replay harness for mesh-replier.py. Drives onReceive with synthetic or recorded
+#packet streams through a stand-in interface, no radio needed.
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BROADCAST = 0xffffffff
+MY_NODE_NUM = 0x4358b7c0
+
+
+def load_replier(path=None):
+    """Import mesh-replier.py as a module (the file name isn't a valid module name)."""
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "mesh-replier.py")
+    spec = importlib.util.spec_from_file_location("mesh_replier", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeMyInfo:
+    def __init__(self, my_node_num):
+        self.my_node_num = my_node_num
+
+
+class FakeSerialInterface:
+    """Stand-in for meshtastic.serial_interface.SerialInterface: a NodeDB and a sendText that records."""
+    def __init__(self, my_node_num=MY_NODE_NUM, nodes=None, send_delay=0.0):
+        self.myInfo = FakeMyInfo(my_node_num)
+        self.nodes = nodes or {}
+        self.send_delay = send_delay
+        self.sent = []
+
+    def sendText(self, text, destinationId=BROADCAST, wantAck=False, wantResponse=False, channelIndex=0, **kwargs):
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        self.sent.append((destinationId, text))
+
+    def close(self):
+        pass
+
+
+def make_nodedb(node_ids, known_fraction=0.8, rng=random):
+    """NodeDB dict keyed like the real one ("!%08x"), with user info for known_fraction of the nodes."""
+    nodes = {}
+    for node_id in node_ids:
+        if rng.random() < known_fraction:
+            nodes[f"!{node_id:08x}"] = {"num": node_id, "user": {"longName": f"Bench node {node_id:08x}", "shortName": f"{node_id:08x}"[-4:]}}
+    return nodes
+
+
+def synthetic_stream(count, num_nodes, seed=1, duplicate_rate=0.15, relayed_rate=0.5, dm_rate=0.05):
+    """Yield packet dicts shaped like meshtastic's decoded packets: a mix of text, telemetry,
+    position and nodeinfo, some relayed, some DMs to us, and some duplicates of earlier packets."""
+    rng = random.Random(seed)
+    node_ids = [rng.randrange(0x10000000, 0xfffffffe) for _ in range(num_nodes)]
+    recent = []
+    packet_id = rng.randrange(1, 1 << 31)
+    for _ in range(count):
+        if recent and rng.random() < duplicate_rate:
+            yield dict(rng.choice(recent))
+            continue
+        packet_id += 1
+        sender = rng.choice(node_ids)
+        hop_start = rng.choice((0, 3, 7))
+        hop_limit = hop_start
+        relay_node = sender & 0xff
+        if hop_start and rng.random() < relayed_rate:
+            hop_limit = rng.randrange(0, hop_start)
+            relay_node = rng.randrange(1, 0xff)
+        packet = {"from": sender, "to": BROADCAST, "id": packet_id, "rxTime": int(time.time()),
+                  "rxSnr": round(rng.uniform(-20, 12), 2), "rxRssi": rng.randrange(-130, -30),
+                  "hopStart": hop_start, "hopLimit": hop_limit, "relayNode": relay_node, "channel": 0}
+        kind = rng.random()
+        if kind < 0.4:
+            if rng.random() < dm_rate:
+                packet["to"] = MY_NODE_NUM
+                text = "ping" if rng.random() < 0.6 else "hello bot"
+            else:
+                text = rng.choice(("CQ CQ", "anyone at the booth?", "testing 123", "73 de bench"))
+            packet["decoded"] = {"portnum": "TEXT_MESSAGE_APP", "payload": text.encode(), "text": text}
+        elif kind < 0.7:
+            packet["decoded"] = {"portnum": "TELEMETRY_APP", "telemetry": {"time": int(time.time()), "deviceMetrics": {
+                "batteryLevel": rng.randrange(0, 101), "voltage": round(rng.uniform(3.3, 4.2), 3),
+                "channelUtilization": round(rng.uniform(0, 40), 2), "airUtilTx": round(rng.uniform(0, 5), 2),
+                "uptimeSeconds": rng.randrange(0, 10**6)}}}
+        elif kind < 0.9:
+            packet["decoded"] = {"portnum": "POSITION_APP", "position": {
+                "latitudeI": int((37.7632 + rng.uniform(-0.01, 0.01)) * 1e7),
+                "longitudeI": int((-121.9547 + rng.uniform(-0.01, 0.01)) * 1e7),
+                "altitude": rng.randrange(0, 200), "time": int(time.time()), "precisionBits": rng.choice((13, 16, 19, 32))}}
+        else:
+            packet["decoded"] = {"portnum": "NODEINFO_APP", "user": {"id": f"!{sender:08x}",
+                                 "longName": f"Bench node {sender:08x}", "shortName": f"{sender:08x}"[-4:]}}
+        recent.append(packet)
+        if len(recent) > 64:
+            recent.pop(0)
+        yield packet
+
+
+def save_corpus(path, packets):
+    """Write packets as JSON lines. bytes payloads are stored as hex."""
+    with open(path, "w") as f:
+        for packet in packets:
+            f.write(json.dumps(packet, default=lambda b: b.hex() if isinstance(b, bytes) else repr(b)) + "\n")
+
+
+def load_corpus(path):
+    """Read a JSON-lines corpus written by save_corpus (or hand-made from real traffic)."""
+    packets = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            packet = json.loads(line)
+            decoded = packet.get("decoded", {})
+            if isinstance(decoded.get("payload"), str):
+                try:
+                    decoded["payload"] = bytes.fromhex(decoded["payload"])
+                except ValueError:
+                    decoded["payload"] = decoded["payload"].encode()
+            packets.append(packet)
+    return packets
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run(replier, packets, interface):
+    """Feed packets to onReceive, return per-call latencies in ns and total wall time."""
+    on_receive = replier.onReceive
+    latencies = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for packet in packets:
+        t0 = clock()
+        on_receive(packet, interface)
+        latencies.append(clock() - t0)
+    return latencies, (clock() - start) / 1e9
+
+
+def measure_allocations(replier, packets, interface):
+    """Run packets under tracemalloc. Returns (retained bytes, peak transient bytes, retained blocks), per packet."""
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    run(replier, packets, interface)
+    current, peak = tracemalloc.get_traced_memory()
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+    count = len(packets)
+    return (current - baseline) / count, (peak - baseline) / count, (blocks_after - blocks_before) / count
+
+
+def fresh_state(replier, workdir, interface, record=False):
+    """Point the replier's persistent state at a scratch directory and attach a fresh Radio to interface.
+
+    The radio isn't start()ed, so onReceive handles each packet inline and its cost is what gets measured.
+    With record, it also writes a capture file to workdir.
+    """
+    replier.seen_nodes = replier.SeenNodeStore(os.path.join(workdir, "messagednodes.txt"))
+    replier.radios.clear()
+    replier.heard_packets = replier.DedupeCache()
+    replier.link_store = replier.LinkStore()
+    replier.telemetry_store = replier.TelemetryStore()
+    replier.position_store = replier.PositionStore()
+    replier.name_cache = replier.NameCache()
+    radio = replier.Radio("bench", capture_path=os.path.join(workdir, "bench.mrcap") if record else None)
+    radio.attach(interface)
+    return radio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mesh-replier's onReceive without a radio")
+    parser.add_argument("--packets", type=int, default=20000, help="synthetic packets to generate")
+    parser.add_argument("--nodes", type=int, default=500, help="distinct nodes in the synthetic stream")
+    parser.add_argument("--duplicates", type=float, default=0.15, help="fraction of packets that are rebroadcasts")
+    parser.add_argument("--relayed", type=float, default=0.5, help="fraction of packets that are relayed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--corpus", help="replay a JSON-lines packet corpus instead of generating one")
+    parser.add_argument("--capture", help="replay a binary capture file (see CAPTURE_FILE) instead of generating one")
+    parser.add_argument("--save-corpus", help="write the packet stream to this JSON-lines file")
+    parser.add_argument("--send-delay", type=float, default=0.0, help="seconds each fake sendText blocks")
+    parser.add_argument("--sender", action="store_true", help="run the real SendWorker against the fake radio")
+    parser.add_argument("--record", action="store_true", help="write a capture file while handling, to measure its cost")
+    parser.add_argument("--log", action="store_true", help="keep the replier's console/file log handlers")
+    parser.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--replier", help="path to mesh-replier.py")
+    args = parser.parse_args()
+
+    replier = load_replier(args.replier)
+    quiet = contextlib.nullcontext()
+    if args.log:
+        replier.setup_logging()
+    else:
+        # Keep formatting cost in the measurement but don't write to the console or /tmp
+        devnull = open(os.devnull, "w")
+        handler_class = replier.BatchedStreamHandler if replier.LOG_ASYNC else logging.StreamHandler
+        replier.setup_logging([handler_class(devnull)])
+        quiet = contextlib.redirect_stdout(devnull)
+
+    if args.capture:
+        with replier.CaptureReader(args.capture) as reader:
+            packets = list(reader.packets())
+    elif args.corpus:
+        packets = load_corpus(args.corpus)
+    else:
+        packets = list(synthetic_stream(args.packets, args.nodes, args.seed, args.duplicates, args.relayed))
+    if args.save_corpus:
+        save_corpus(args.save_corpus, packets)
+    node_ids = {packet["from"] for packet in packets}
+    nodes = make_nodedb(node_ids, rng=random.Random(args.seed))
+
+    with tempfile.TemporaryDirectory() as workdir, quiet:
+        interface = FakeSerialInterface(nodes=nodes, send_delay=args.send_delay)
+        radio = fresh_state(replier, workdir, interface, args.record)
+        worker = None
+        if args.sender:
+            radio.scheduler.budget = radio.scheduler.burst = 1e9  # measure the handler, not the airtime budget
+            worker = replier.SendWorker(radio.send_queue, interface)
+            worker.start()
+        latencies, elapsed = run(replier, packets, interface)
+        if worker:
+            worker.stop()
+        if radio.capture:
+            radio.capture.close()
+        replier.seen_nodes.close()
+
+        allocations = None
+        if not args.no_alloc:
+            alloc_interface = FakeSerialInterface(nodes=nodes)
+            alloc_radio = fresh_state(replier, workdir, alloc_interface, args.record)
+            allocations = measure_allocations(replier, packets, alloc_interface)
+            if alloc_radio.capture:
+                alloc_radio.capture.close()
+            replier.seen_nodes.close()
+
+    latencies.sort()
+    print(f"packets:        {len(packets)} from {len(node_ids)} nodes")
+    print(f"throughput:     {len(packets) / elapsed:,.0f} packets/s")
+    print(f"latency p50:    {percentile(latencies, 0.50) / 1000:.1f} us")
+    print(f"latency p99:    {percentile(latencies, 0.99) / 1000:.1f} us")
+    print(f"latency max:    {latencies[-1] / 1000:.1f} us")
+    if allocations is not None:
+        retained_bytes, peak_bytes, retained_blocks = allocations
+        print(f"memory:         {retained_bytes:,.1f} bytes/packet retained, {peak_bytes:,.1f} bytes/packet peak")
+        print(f"allocations:    {retained_blocks:.2f} live blocks/packet")
+    print(f"sends:          {len(interface.sent)} sent, send queue {radio.send_queue.snapshot()}")
+    print(f"dedupe:         {radio.dedupe.snapshot()}")
+    print(f"name cache:     {replier.name_cache.snapshot()}")
+    if radio.capture:
+        print(f"capture:        {radio.capture.records} records, {radio.capture.bytes_written / max(radio.capture.records, 1):.1f} bytes/packet")
+    if replier.log_handler:
+        print(f"log records:    {replier.log_handler.dropped} dropped (queue full)")
+
+
+if __name__ == "__main__":
+    main()
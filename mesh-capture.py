@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+#Offline analysis of mesh-replier capture files (see CAPTURE_FILE in mesh-replier.py).
+
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import sys
+
+
+def load_replier(path=None):
+    """Import mesh-replier.py as a module (the file name isn't a valid module name)."""
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "mesh-replier.py")
+    spec = importlib.util.spec_from_file_location("mesh_replier", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def summary(replier, paths):
+    """Record count, time span and packets per portnum across the capture files."""
+    records = 0
+    first = last = None
+    portnums = {}
+    for path in paths:
+        with replier.CaptureReader(path) as reader:
+            columns = reader.columns(("time", "portnum"))
+        times = columns["time"]
+        if times:
+            first = min(first, min(times)) if first is not None else min(times)
+            last = max(last, max(times)) if last is not None else max(times)
+        records += len(times)
+        for portnum in columns["portnum"]:
+            portnums[portnum] = portnums.get(portnum, 0) + 1
+    return {"records": records, "first": first, "last": last,
+            "portnums": {str(replier.portnum_name(portnum)): count for portnum, count in sorted(portnums.items(), key=lambda item: -item[1])}}
+
+
+def export_csv(replier, paths, out):
+    """One CSV row per record, fixed fields only."""
+    writer = csv.writer(out)
+    writer.writerow(("file",) + replier.CAPTURE_FIELDS)
+    for path in paths:
+        with replier.CaptureReader(path) as reader:
+            columns = reader.columns()
+        columns["snr"] = [round(snr, 2) for snr in columns["snr"]]  # stored as float32
+        name = os.path.basename(path)
+        writer.writerows((name,) + row for row in zip(*columns.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or export mesh-replier capture files")
+    parser.add_argument("command", choices=("summary", "signal", "csv"),
+                        help="summary: counts per portnum; signal: SNR/RSSI per node as JSON; csv: every record")
+    parser.add_argument("captures", nargs="+", help="capture files")
+    parser.add_argument("--replier", help="path to mesh-replier.py")
+    args = parser.parse_args()
+
+    replier = load_replier(args.replier)
+    if args.command == "summary":
+        json.dump(summary(replier, args.captures), sys.stdout, indent=2)
+        print()
+    elif args.command == "signal":
+        nodes = {}
+        for path in args.captures:
+            with replier.CaptureReader(path) as reader:
+                for node_id, stats in reader.node_signal_stats().items():
+                    nodes[f"!{node_id:08x}/{os.path.basename(path)}"] = stats
+        json.dump(nodes, sys.stdout, indent=2)
+        print()
+    else:
+        export_csv(replier, args.captures, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,30 @@
 #Modified by KG6MDW https://github.com/Marx1/Meshtastic-mesh-replier-Local/
 
 import time
-import meshtastic
-import meshtastic.serial_interface
+_process_start = time.monotonic()  # for time-to-ready; meshtastic itself is imported when a radio connects
 from pubsub import pub
 import datetime
-import binascii
 import logging
 import sys
-from logging.handlers import RotatingFileHandler
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from socketserver import ThreadingTCPServer
+from logging.handlers import QueueHandler, RotatingFileHandler
+import queue
+import atexit
+from http import HTTPStatus
+import asyncio
+import json
 import threading
+from collections import OrderedDict, deque
+from bisect import bisect_left
+from array import array
+from math import cos, fsum, hypot, radians
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
-import socket
 import os
 import errno
+import mmap
+import random
+import struct
 
 # Precision bits to uncertainty mapping
 PRECISION_BITS_MAP = {
@@ -35,397 +44,2293 @@ PRECISION_BITS_MAP = {
 }
 
 #Database (simple text file) of nodes we've messaged.
-nodelist = []
-open("messagednodes.txt", "a").close()
-with open("messagednodes.txt", "r") as f:
-    for line in f:
-        line = line.strip()
-        if line:
+#One node ID per line. New nodes are appended, the file is rewritten only on compaction.
+#A line with a negative ID (-123) un-marks the node, e.g. when its greeting was dropped before it went out.
+SEEN_NODES_FILE = "messagednodes.txt"
+SEEN_FSYNC_BATCH = 32        # fsync after this many unsynced appends...
+SEEN_FSYNC_INTERVAL = 2.0    # ...or after this many seconds, whichever comes first
+SEEN_COMPACT_RATIO = 2       # compact when the journal has this many times more lines than live nodes
+
+class SeenNodeStore:
+    """Set of node IDs we've already greeted, backed by an append-only journal file.
+
+    Membership is a set lookup. The journal is loaded on first use, appends are
+    batched and fsync'd every SEEN_FSYNC_BATCH entries or SEEN_FSYNC_INTERVAL seconds,
+    and the file is compacted (deduplicated, torn lines dropped) when it grows too
+    far past the live set.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._nodes = None
+        self._journal = None
+        self._journal_lines = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        nodes = set()
+        lines = 0
+        dirty = False
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        entries = data.split(b"\n")
+        if not data.endswith(b"\n"):
+            entries.pop()  # a torn last write, even if what's left of it parses as a number
+        for line in entries:
+            line = line.strip()
+            if not line:
+                continue
+            lines += 1
             try:
-                nodelist.append(int(line))
+                node_id = int(line)
+                if node_id < 0:
+                    nodes.discard(-node_id)
+                else:
+                    nodes.add(node_id)
             except ValueError:
-                pass  # skip lines that aren't valid integers
+                dirty = True  # skip lines that aren't valid integers (e.g. a torn write)
+        if data and not data.endswith(b"\n"):
+            dirty = True
+        self._nodes = nodes
+        self._journal_lines = lines
+        if dirty or lines >= SEEN_COMPACT_RATIO * max(len(nodes), 1) and lines > len(nodes):
+            self._compact()
+        else:
+            self._journal = open(self.path, "a")
+
+    def _ensure_loaded(self):
+        if self._nodes is None:
+            self._load()
+
+    def load(self):
+        """Read the journal now instead of on first use."""
+        with self._lock:
+            self._ensure_loaded()
+
+    def _compact(self):
+        """Rewrite the journal with one line per live node, atomically."""
+        if self._journal:
+            self._journal.close()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("".join(f"{node_id}\n" for node_id in self._nodes))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._journal = open(self.path, "a")
+        self._journal_lines = len(self._nodes)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync(self):
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def __contains__(self, node_id):
+        if self._nodes is None:
+            with self._lock:
+                self._ensure_loaded()
+        return node_id in self._nodes
+
+    def __len__(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._nodes)
+
+    def add(self, node_id):
+        """Record node_id. Returns False if it was already present."""
+        with self._lock:
+            self._ensure_loaded()
+            if node_id in self._nodes:
+                return False
+            self._nodes.add(node_id)
+            self._journal.write(f"{node_id}\n")
+            self._journal_lines += 1
+            self._unsynced += 1
+            if self._unsynced >= SEEN_FSYNC_BATCH:
+                self._sync()
+            return True
+
+    def discard(self, node_id):
+        """Forget node_id, so it is greeted again next time."""
+        with self._lock:
+            self._ensure_loaded()
+            if node_id not in self._nodes:
+                return
+            self._nodes.discard(node_id)
+            self._journal.write(f"-{node_id}\n")
+            self._journal_lines += 1
+            self._unsynced += 1
+            if self._unsynced >= SEEN_FSYNC_BATCH:
+                self._sync()
+
+    def maybe_sync(self):
+        """Flush pending appends if the batch interval has passed. Call periodically."""
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_sync >= SEEN_FSYNC_INTERVAL:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._journal:
+                if self._journal_lines >= SEEN_COMPACT_RATIO * max(len(self._nodes), 1) and self._journal_lines > len(self._nodes):
+                    self._compact()
+                self._sync()
+                self._journal.close()
+                self._journal = None
+
+seen_nodes = SeenNodeStore(SEEN_NODES_FILE)
 
 # Configure logging
+LOG_FILE = '/tmp/mesh-replier.log'
+LOG_ASYNC = True          # hand records to a background writer thread instead of writing on the radio thread
+LOG_QUEUE_SIZE = 10000    # records buffered for the writer; beyond this they are dropped and counted
+LOG_BATCH_SIZE = 256      # records written per flush
+
 logger = logging.getLogger('MeshReplier')
 logger.setLevel(logging.INFO)
 
 # Remove existing handlers to prevent duplication
 logger.handlers = []
 
-# Console handler
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(console_handler)
+class _BatchFlushMixin:
+    """Handler that only flushes when the log writer finishes a batch, not after every record."""
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+class BatchedStreamHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
 
-# File handler for /tmp/mesh-replier.log
-file_handler = RotatingFileHandler('/tmp/mesh-replier.log', maxBytes=10*1024*1024, backupCount=5)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
+class BatchedRotatingFileHandler(_BatchFlushMixin, RotatingFileHandler):
+    pass
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks or formats on the caller's thread.
+
+    Records are queued as-is (message formatting happens in the writer), and when
+    the queue is full the record is dropped and counted.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LogWriter(threading.Thread):
+    """Background thread that drains the log queue into the real handlers, flushing once per batch."""
+    def __init__(self, log_queue, handlers, batch_size=LOG_BATCH_SIZE):
+        super().__init__(name="mesh-log-writer", daemon=True)
+        self.log_queue = log_queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set() or not self.log_queue.empty():
+            try:
+                batch = [self.log_queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                pass
+            for record in batch:
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                getattr(handler, "flush_batch", handler.flush)()
+
+    def stop(self):
+        """Write out everything still queued, then stop."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handler = None
+log_writer = None
 
 # Disable propagation to prevent Meshtastic's logger from duplicating output
 logger.propagate = False
 
-# Configure Meshtastic's logger to avoid console output
-meshtastic_logger = logging.getLogger('meshtastic')
-meshtastic_logger.handlers = []  # Remove any existing handlers
-meshtastic_logger.propagate = False  # Prevent propagation to root logger
-meshtastic_logger.addHandler(logging.NullHandler())  # Suppress output
-
-# Global Meshtastic interface (to be initialized later)
-interface = None
-'''
-class CustomThreadingTCPServer(ThreadingTCPServer):
-    """Custom ThreadingTCPServer for IPv6 binding."""
-    def __init__(self, server_address, RequestHandlerClass):
-        self.address_family = socket.AF_INET6
-        try:
-            # Initialize parent class first
-            super().__init__(server_address, RequestHandlerClass)
-            self.socket = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            logger.info(f"Binding to {server_address}")
-            self.socket.bind(server_address)
-            self.socket.listen(5)
-            logger.info(f"Successfully bound to {server_address}")
-        except socket.gaierror as e:
-            logger.error(f"Socket binding failed (gaierror): {e}")
-            self.socket.close()
-            raise
-        except socket.error as e:
-            logger.error(f"Socket error during setup: {e}")
-            self.socket.close()
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected error during socket setup: {e}")
-            self.socket.close()
-            raise
+def setup_logging(handlers=None):
+    """Send the logger to the console and LOG_FILE (or to handlers), through the log writer thread
+    if LOG_ASYNC is set. Called from main(), so importing the script doesn't open the log file."""
+    global log_handler, log_writer
+    if handlers is None:
+        # Console handler
+        console_handler = (BatchedStreamHandler if LOG_ASYNC else logging.StreamHandler)(sys.stdout)
+        # File handler for /tmp/mesh-replier.log
+        file_handler = (BatchedRotatingFileHandler if LOG_ASYNC else RotatingFileHandler)(LOG_FILE, maxBytes=10*1024*1024, backupCount=5)
+        handlers = [console_handler, file_handler]
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(log_formatter)
+
+    logger.handlers = []
+    if LOG_ASYNC:
+        log_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        logger.addHandler(log_handler)
+        log_writer = LogWriter(log_handler.queue, handlers)
+        log_writer.start()
+        atexit.register(log_writer.stop)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    # Configure Meshtastic's logger to avoid console output
+    meshtastic_logger = logging.getLogger('meshtastic')
+    meshtastic_logger.handlers = []  # Remove any existing handlers
+    meshtastic_logger.propagate = False  # Prevent propagation to root logger
+    meshtastic_logger.addHandler(logging.NullHandler())  # Suppress output
+
+# Metrics. Prometheus text format, served on a local port for scraping.
+METRICS_ENABLED = True
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+def _format_labels(labelnames, labels):
+    if not labelnames:
+        return ""
+    pairs = ",".join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(labelnames, labels))
+    return "{" + pairs + "}"
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values."""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Gauge(Counter):
+    """Gauge that is either set directly or read from a function at scrape time.
+
+    With kind="counter" it exposes a count kept elsewhere (e.g. SendQueue.stats) as a counter.
+    """
+    def __init__(self, name, help_text, labelnames=(), kind="gauge"):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, labels, fn):
+        with self._lock:
+            self._values[labels] = fn
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    """Fixed-bucket histogram. observe() is a bisect and two increments."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        labelnames = self.labelnames + ("le",)
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                yield self.name + "_bucket", _format_labels(labelnames, labels + (bound,)), cumulative
+            yield self.name + "_count", _format_labels(self.labelnames, labels), cumulative
+            yield self.name + "_sum", _format_labels(self.labelnames, labels), series[-1]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+PACKETS_RECEIVED = metrics.register(Counter("meshreplier_packets_received_total", "Packets handled, by portnum and whether they were heard direct or relayed", ("radio", "portnum", "path")))
+DUPLICATES_DROPPED = metrics.register(Gauge("meshreplier_duplicate_packets_dropped_total", "Rebroadcasts dropped by the dedupe cache", ("radio",), kind="counter"))
+RECEIVE_DROPPED = metrics.register(Gauge("meshreplier_receive_queue_dropped_total", "Packets dropped because the radio's receive queue was full", ("radio",), kind="counter"))
+HANDLER_LATENCY = metrics.register(Histogram("meshreplier_handler_seconds", "Time spent handling one packet", ("radio",)))
+TEXTS_SENT = metrics.register(Counter("meshreplier_texts_sent_total", "Texts handed to the radio, by kind (pong, reply, greeting, announce)", ("radio", "kind")))
+SEND_FAILURES = metrics.register(Counter("meshreplier_send_failures_total", "sendText calls that raised", ("radio", "kind")))
+RATE_LIMITED = metrics.register(Gauge("meshreplier_rate_limited_total", "DMs not answered because the sender was over its rate limit", ("radio", "kind"), kind="counter"))
+SEND_QUEUE_DEPTH = metrics.register(Gauge("meshreplier_send_queue_depth", "Messages waiting in the send queue", ("radio",)))
+SEND_QUEUE_DROPPED = metrics.register(Gauge("meshreplier_send_queue_dropped_total", "Messages dropped or evicted because the send queue was full", ("radio",), kind="counter"))
+SEND_PREDICTED_WAIT = metrics.register(Gauge("meshreplier_send_predicted_wait_seconds", "Predicted time until the send queue is drained at the airtime budget", ("radio",)))
+AIRTIME_USED = metrics.register(Gauge("meshreplier_airtime_seconds_total", "Estimated time on air spent transmitting", ("radio",), kind="counter"))
+NODEDB_LOOKUPS = metrics.register(Counter("meshreplier_nodedb_lookups_total", "NodeDB lookups for node names (name cache misses), by result", ("result",)))
+SEEN_NODES = metrics.register(Gauge("meshreplier_seen_nodes", "Nodes in the greeted-node store"))
+TELEMETRY_NODES = metrics.register(Gauge("meshreplier_telemetry_nodes", "Nodes with stored telemetry"))
+POSITION_NODES = metrics.register(Gauge("meshreplier_position_nodes", "Nodes with a known position"))
+LINK_NODES = metrics.register(Gauge("meshreplier_link_nodes", "Nodes with link quality stats"))
+NAME_CACHE_LOOKUPS = metrics.register(Gauge("meshreplier_name_cache_lookups_total", "Node name lookups, by cache result", ("result",), kind="counter"))
+CAPTURE_RECORDS = metrics.register(Gauge("meshreplier_capture_records_total", "Packets written to the capture file", ("radio",), kind="counter"))
+RADIO_CONNECTED = metrics.register(Gauge("meshreplier_radio_connected", "1 while the radio's serial interface is connected and configured", ("radio",)))
+RADIO_RECONNECTS = metrics.register(Gauge("meshreplier_radio_reconnects_total", "Times the radio was reconnected after losing the connection", ("radio",), kind="counter"))
+RADIO_READY_SECONDS = metrics.register(Gauge("meshreplier_radio_ready_seconds", "Seconds from process start, or from losing the connection, until the radio was ready", ("radio",)))
+LOG_DROPPED = metrics.register(Gauge("meshreplier_log_records_dropped_total", "Log records dropped because the log queue was full", kind="counter"))
+
+# Transmit scheduler. Every send is charged its estimated time-on-air against a channel budget.
+LORA_PRESET = "MEDIUM_SLOW"
+TX_AIRTIME_BUDGET = 0.10   # fraction of channel time the bot may spend transmitting
+TX_AIRTIME_BURST = 10.0    # seconds of airtime that may go out back to back before the budget kicks in
+MESH_PACKET_OVERHEAD = 32  # bytes added to the text: mesh header, Data protobuf and DM auth tag
+STATUS_INTERVAL = 60       # seconds between send queue status lines in the log
+
+# Meshtastic modem presets: (bandwidth Hz, spreading factor, coding rate 4/x)
+LORA_PRESETS = {
+    "SHORT_TURBO": (500000, 7, 5),
+    "SHORT_FAST": (250000, 7, 5),
+    "SHORT_SLOW": (250000, 8, 5),
+    "MEDIUM_FAST": (250000, 9, 5),
+    "MEDIUM_SLOW": (250000, 10, 5),
+    "LONG_FAST": (250000, 11, 5),
+    "LONG_MODERATE": (125000, 11, 8),
+    "LONG_SLOW": (125000, 12, 8),
+    "VERY_LONG_SLOW": (62500, 12, 8),
+}
+LORA_PREAMBLE_SYMBOLS = 16
+
+def lora_airtime(payload_len, preset=LORA_PRESET):
+    """Time-on-air in seconds for a LoRa frame (Semtech AN1200.13, explicit header, CRC on)."""
+    bandwidth, sf, cr = LORA_PRESETS[preset]
+    t_sym = (1 << sf) / bandwidth
+    low_dr = 1 if t_sym > 0.016 else 0
+    t_preamble = (LORA_PREAMBLE_SYMBOLS + 4.25) * t_sym
+    bits = 8 * payload_len - 4 * sf + 28 + 16
+    payload_symbols = 8 + max(-(-bits // (4 * (sf - 2 * low_dr))) * cr, 0)
+    return t_preamble + payload_symbols * t_sym
+
+class TxScheduler:
+    """Airtime token bucket: refills at TX_AIRTIME_BUDGET seconds per second, holds up to TX_AIRTIME_BURST."""
+    def __init__(self, preset=LORA_PRESET, budget=TX_AIRTIME_BUDGET, burst=TX_AIRTIME_BURST):
+        self.preset = preset
+        self.budget = budget
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.airtime_used = 0.0
+
+    def estimate(self, text):
+        return lora_airtime(len(text.encode("utf-8")) + MESH_PACKET_OVERHEAD, self.preset)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.budget)
+        self._last = now
+
+    def reserve(self, airtime):
+        """Charge airtime if the budget allows. Returns 0 on success, else seconds to wait before retrying.
+
+        A frame longer than the whole burst (a long text on the slow presets) can never fit, so it is
+        let through once the bucket is full and the tokens go negative, delaying whatever comes next.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(airtime, self.burst)
+            if self._tokens >= needed:
+                self._tokens -= airtime
+                self.airtime_used += airtime
+                return 0
+            return (needed - self._tokens) / self.budget
+
+    def predicted_wait(self, queued_airtime):
+        """Seconds until queued_airtime worth of messages has gone out at the current budget."""
+        with self._lock:
+            self._refill()
+            return max(0.0, queued_airtime - self._tokens) / self.budget
+
+# Outbound send queue. onReceive only enqueues, a worker thread does the (slow) radio sends.
+SEND_QUEUE_SIZE = 512
+SEND_QUEUE_FULL_POLICY = "drop_lowest"  # "drop_lowest": evict a queued lower-priority item, else drop the new one. "drop_new": always drop the new one.
+
+# Priority classes, lower is sent first
+PRIO_PONG = 0
+PRIO_REPLY = 1
+PRIO_GREETING = 2
+PRIO_ANNOUNCE = 3  # messages pushed through the HTTP API
+PRIO_NAMES = {PRIO_PONG: "pong", PRIO_REPLY: "reply", PRIO_GREETING: "greeting", PRIO_ANNOUNCE: "announce"}
+
+class OutboundMessage:
+    """One queued send. texts are sent back to back to the same destination."""
+    __slots__ = ("priority", "texts", "kwargs", "coalesce_key", "label", "enqueued_at", "airtime", "delivery", "on_drop")
+
+    def __init__(self, priority, texts, kwargs, coalesce_key=None, label="", airtime=0.0):
+        self.priority = priority
+        self.texts = texts
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.label = label
+        self.enqueued_at = time.monotonic()
+        self.airtime = airtime
+        self.delivery = None  # optional Delivery, updated as the message goes out
+        self.on_drop = None   # optional callback, called if the message is evicted from the queue
+
+class SendQueue:
+    """Bounded priority queue of OutboundMessages with drop/coalesce policies.
+
+    A message with a coalesce_key replaces the still-queued message with the same key
+    instead of taking a new slot (e.g. several pings from one node get one pong).
+    """
+    def __init__(self, scheduler, maxsize=SEND_QUEUE_SIZE, policy=SEND_QUEUE_FULL_POLICY):
+        self.scheduler = scheduler
+        self.maxsize = maxsize
+        self.policy = policy
+        self._queues = [deque() for _ in PRIO_NAMES]
+        self._by_key = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.queued_airtime = 0.0
+        self.stats = {"enqueued": 0, "coalesced": 0, "dropped": 0, "evicted": 0, "sent": 0, "failed": 0, "high_water": 0}
+
+    def __len__(self):
+        return self._size
+
+    def put(self, message):
+        """Queue a message without blocking. Returns False if it was dropped."""
+        with self._cond:
+            if message.coalesce_key is not None:
+                queued = self._by_key.get(message.coalesce_key)
+                if queued is not None:
+                    self.queued_airtime += message.airtime - queued.airtime
+                    queued.texts = message.texts
+                    queued.kwargs = message.kwargs
+                    queued.airtime = message.airtime
+                    self.stats["coalesced"] += 1
+                    return True
+            if self._size >= self.maxsize and not self._evict_for(message.priority):
+                self.stats["dropped"] += 1
+                return False
+            self._queues[message.priority].append(message)
+            if message.coalesce_key is not None:
+                self._by_key[message.coalesce_key] = message
+            self._size += 1
+            self.queued_airtime += message.airtime
+            self.stats["enqueued"] += 1
+            if self._size > self.stats["high_water"]:
+                self.stats["high_water"] = self._size
+            self._cond.notify()
+            return True
+
+    def _evict_for(self, priority):
+        """Make room for a message of the given priority by dropping the newest lower-priority one."""
+        if self.policy != "drop_lowest":
+            return False
+        for prio in range(len(self._queues) - 1, priority, -1):
+            if self._queues[prio]:
+                victim = self._queues[prio].pop()
+                self._forget(victim)
+                if victim.delivery:
+                    victim.delivery.dropped("evicted from full send queue")
+                if victim.on_drop:
+                    victim.on_drop()
+                self.stats["evicted"] += 1
+                return True
+        return False
+
+    def _forget(self, message):
+        if message.coalesce_key is not None and self._by_key.get(message.coalesce_key) is message:
+            del self._by_key[message.coalesce_key]
+        self._size -= 1
+        self.queued_airtime -= message.airtime
+
+    def get(self, timeout=None):
+        """Pop the highest-priority message, waiting up to timeout. Returns None on timeout or close."""
+        with self._cond:
+            if not self._size and not self._closed:
+                self._cond.wait(timeout)
+            for queue in self._queues:
+                if queue:
+                    message = queue.popleft()
+                    self._forget(message)
+                    return message
+            return None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
 
-    def server_close(self):
-        """Ensure socket is properly closed."""
+    def snapshot(self):
+        """Counters plus current depth per priority class, queued airtime and predicted wait."""
+        with self._cond:
+            stats = dict(self.stats)
+            stats["depth"] = self._size
+            for prio, name in PRIO_NAMES.items():
+                stats[f"depth_{name}"] = len(self._queues[prio])
+            stats["queued_airtime"] = round(self.queued_airtime, 2)
+            queued_airtime = self.queued_airtime
+        stats["predicted_wait"] = round(self.scheduler.predicted_wait(queued_airtime), 1)
+        stats["airtime_used"] = round(self.scheduler.airtime_used, 1)
+        return stats
+
+class SendWorker(threading.Thread):
+    """Drains a SendQueue into interface.sendText so the receive thread never blocks on the radio.
+
+    Each text waits for the queue's TxScheduler airtime budget before it is handed to the radio.
+    If a `connected` event is given, sending also pauses while it is clear (the radio is reconnecting).
+    """
+    def __init__(self, send_queue, interface, radio_name="radio", connected=None):
+        super().__init__(name=f"{radio_name}-sender", daemon=True)
+        self.radio_name = radio_name
+        self.send_queue = send_queue
+        self.interface = interface
+        self.scheduler = send_queue.scheduler
+        self.connected = connected
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            message = self.send_queue.get(timeout=1)
+            if message is None:
+                continue
+            for text in message.texts:
+                if self.connected is not None:
+                    while not self.connected.wait(1):
+                        if self._stop_event.is_set():
+                            return
+                airtime = self.scheduler.estimate(text)
+                wait = self.scheduler.reserve(airtime)
+                while wait and not self._stop_event.wait(wait):
+                    wait = self.scheduler.reserve(airtime)
+                if self._stop_event.is_set():
+                    return
+                try:
+                    packet = self.interface.sendText(text, **message.kwargs)
+                    self.send_queue.stats["sent"] += 1
+                    TEXTS_SENT.inc((self.radio_name, PRIO_NAMES[message.priority]))
+                    if message.delivery:
+                        message.delivery.sent(packet)
+                except Exception as e:
+                    self.send_queue.stats["failed"] += 1
+                    SEND_FAILURES.inc((self.radio_name, PRIO_NAMES[message.priority]))
+                    logger.error("Failed to send %s: %s", message.label, e)
+                    if message.delivery:
+                        message.delivery.failed(e)
+
+    def stop(self):
+        self._stop_event.set()
+        self.send_queue.close()
+
+# Duplicate packet suppression. Rebroadcasts of a packet we already handled are dropped on arrival.
+DEDUPE_SIZE = 4096  # (from, packet id) pairs remembered
+DEDUPE_TTL = 600    # seconds a packet id is remembered
+
+class DedupeCache:
+    """Fixed-size set of (from, packet id) with time-based eviction.
+
+    Entries are kept in arrival order, so expired ones are always at the front.
+    """
+    def __init__(self, size=DEDUPE_SIZE, ttl=DEDUPE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        """Return True if key was seen within the TTL, otherwise remember it and return False."""
+        now = time.monotonic()
+        with self._lock:
+            seen = self._seen
+            while seen:
+                oldest_key, oldest_time = next(iter(seen.items()))
+                if now - oldest_time < self.ttl:
+                    break
+                del seen[oldest_key]
+            if key in seen:
+                self.hits += 1
+                return True
+            seen[key] = now
+            if len(seen) > self.size:
+                seen.popitem(last=False)
+            self.misses += 1
+            return False
+
+    def snapshot(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._seen),
+                "hit_ratio": round(self.hits / total, 3) if total else 0.0}
+
+# Per-node rate limits for DMs to the bot: (burst, refill per second)
+PING_RATE_LIMIT = (3, 1 / 60)      # 3 pongs, then one a minute
+REPLY_RATE_LIMIT = (1, 1 / 600)    # one canned reply, then one every 10 minutes
+COMMAND_RATE_LIMIT = (5, 1 / 60)   # 5 replies to other DM commands (help, signal, ...), then one a minute
+RATE_LIMIT_NODES = 2048            # per-node buckets kept, least recently used are evicted
+
+class NodeRateLimiter:
+    """Per-node token buckets with LRU eviction so memory stays bounded however many nodes DM us.
+
+    An evicted node simply starts again with a full bucket.
+    """
+    def __init__(self, limit, max_nodes=RATE_LIMIT_NODES):
+        self.burst, self.rate = limit
+        self.max_nodes = max_nodes
+        self._buckets = OrderedDict()  # node_id -> [tokens, last refill time]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+        self.evicted = 0
+
+    def allow(self, node_id):
+        """Take a token for node_id. Returns False if the node is over its limit."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(node_id)
+            if bucket is None:
+                bucket = self._buckets[node_id] = [self.burst, now]
+                if len(self._buckets) > self.max_nodes:
+                    self._buckets.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._buckets.move_to_end(node_id)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.allowed += 1
+                return True
+            self.throttled += 1
+            return False
+
+    def snapshot(self):
+        return {"allowed": self.allowed, "throttled": self.throttled, "nodes": len(self._buckets), "evicted": self.evicted}
+
+# Packet capture. With CAPTURE_FILE set, every packet a radio handles (duplicates included) is appended to a
+# binary file: CAPTURE_MAGIC, then one length-prefixed record per packet. CaptureReader reads it back.
+CAPTURE_FILE = None                # e.g. "capture-{radio}.mrcap"; {radio} is replaced with the radio name
+CAPTURE_BATCH_BYTES = 64 * 1024    # records are buffered and written this many bytes at a time...
+CAPTURE_FLUSH_INTERVAL = 5.0       # ...or after this many seconds, whichever comes first
+CAPTURE_MAGIC = b"MRCAP\x00\x01\n"
+# u32 length of the rest of the record, then the fixed fields below, then the raw payload.
+# Missing SNR is stored as NaN and missing RSSI as 0.
+CAPTURE_RECORD = struct.Struct("<IdIIIBBBBfhH")
+CAPTURE_FIELDS = ("time", "from", "to", "id", "hop_start", "hop_limit", "relay_node", "channel", "snr", "rssi", "portnum")
+CAPTURE_TYPECODES = "dIIIBBBBfhH"  # array typecodes of CAPTURE_FIELDS
+
+_portnum_numbers = {}
+
+def portnum_number(name):
+    """Numeric PortNum of a decoded packet's portnum name, 0 if unknown."""
+    if isinstance(name, int):
+        return name
+    number = _portnum_numbers.get(name)
+    if number is None:
+        from meshtastic.protobuf import portnums_pb2
         try:
-            self.socket.close()
-            logger.info("Server socket closed")
-        except Exception as e:
-            logger.error(f"Error closing server socket: {e}")
+            number = portnums_pb2.PortNum.Value(name)
+        except ValueError:
+            number = 0
+        _portnum_numbers[name] = number
+    return number
 
-def run_http_server():
-    """Run the HTTP server on port 8080 with IPv6 support."""
-    port = 8080
-    server_address = ('::', port)
-    
-    # Log network configuration for debugging
-    try:
-        logger.info("Network interfaces:")
-        for line in os.popen("ip addr").readlines():
-            logger.info(line.strip())
-        logger.info("IPv6 status:")
-        for line in os.popen("sysctl net.ipv6.conf.all.disable_ipv6 net.ipv6.bindv6only").readlines():
-            logger.info(line.strip())
-        logger.info("Port 8080 status:")
-        for line in os.popen("netstat -tulnp | grep 8080").readlines():
-            logger.info(line.strip())
-    except Exception as e:
-        logger.error(f"Failed to log network configuration: {e}")
-
-    # Attempt to bind to :: on port 8080
+def portnum_name(number):
+    from meshtastic.protobuf import portnums_pb2
     try:
-        httpd = CustomThreadingTCPServer(server_address, MeshHTTPRequestHandler)
-        logger.info(f"Starting HTTP server on {server_address[0]}:{port} (IPv6)")
-        httpd.serve_forever()
-    except socket.error as e:
-        if e.errno == errno.EADDRINUSE:
-            logger.error(f"Port {port} is already in use. Checking processes...")
-            os.system("netstat -tulnp | grep 8080")
-            logger.error("Please free port 8080 or choose a different port.")
-        logger.error(f"Failed to bind to {server_address[0]}:{port}: {e}")
-        sys.exit(1)
-    except Exception as e:
-        logger.error(f"Failed to start HTTP server: {e}")
-        sys.exit(1)
-
-class MeshHTTPRequestHandler(BaseHTTPRequestHandler):
-    """Handle HTTP GET requests to send Meshtastic messages."""
-    def do_GET(self):
-        global interface
+        return portnums_pb2.PortNum.Name(number)
+    except ValueError:
+        return number
+
+class CaptureWriter:
+    """Appends packets to a capture file. Records are packed into a buffer on the receive thread
+    and written once CAPTURE_BATCH_BYTES have built up or CAPTURE_FLUSH_INTERVAL has passed.
+
+    open() is called at startup: an existing capture is appended to, after cutting off a torn
+    last record left by a crash. Capture is optional, so if the file can't be opened or written
+    the error is logged and capture is turned off rather than getting in the way of packet handling.
+    """
+    def __init__(self, path, batch_bytes=CAPTURE_BATCH_BYTES, flush_interval=CAPTURE_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.records = 0
+        self.bytes_written = 0
+        self.enabled = True
+        self._file = None
+        self._buffer = bytearray()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Open (and if needed repair) the file. Returns False, with capture turned off, if that fails."""
+        with self._lock:
+            try:
+                self._open()
+            except Exception as e:
+                self._disable(e)
+        return self.enabled
+
+    def _disable(self, error):
+        logger.error("%s: capture failed, turning it off: %s", self.path, error)
+        self.enabled = False
+        self._buffer.clear()
+        if self._file:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _open(self):
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size:
+            with CaptureReader(self.path) as reader:
+                end = reader.valid_end()
+            self._file = open(self.path, "r+b")
+            if end < size:
+                logger.warning("%s: dropping %d bytes of a torn record at the end of the capture", self.path, size - end)
+                self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(self.path, "wb")
+            self._file.write(CAPTURE_MAGIC)
+
+    def write(self, packet, timestamp=None):
+        if not self.enabled:
+            return
+        try:
+            decoded = packet.get('decoded', {})
+            payload = decoded.get('payload')
+            if not isinstance(payload, bytes):
+                payload = decoded.get('text', '').encode()
+            record = CAPTURE_RECORD.pack(
+                CAPTURE_RECORD.size - 4 + len(payload), timestamp or time.time(),
+                packet.get('from', 0) & 0xffffffff, packet.get('to', 0) & 0xffffffff, packet.get('id', 0) & 0xffffffff,
+                packet.get('hopStart', 0) & 0xff, packet.get('hopLimit', 0) & 0xff, packet.get('relayNode', 0) & 0xff,
+                packet.get('channel', 0) & 0xff, packet.get('rxSnr', NAN), packet.get('rxRssi', 0),
+                portnum_number(decoded.get('portnum', 0)))
+        except (struct.error, TypeError, AttributeError) as e:
+            logger.debug("%s: packet not captured: %s", self.path, e)  # a field out of range or of the wrong type
+            return
+        with self._lock:
+            self._buffer += record
+            self._buffer += payload
+            self.records += 1
+            if len(self._buffer) >= self.batch_bytes:
+                self._flush()
+
+    def _flush(self):
+        if self._file is None:
+            self._buffer.clear()  # not open: open() failed or close() was called
+            return
         try:
-            # Parse the URL and query parameters
-            parsed_url = urllib.parse.urlparse(self.path)
-            query_params = urllib.parse.parse_qs(parsed_url.query)
+            self._file.write(self._buffer)
+            self._file.flush()
+        except Exception as e:
+            self._disable(e)
+            return
+        self.bytes_written += len(self._buffer)
+        self._buffer.clear()
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        """Write buffered records if the flush interval has passed. Call periodically."""
+        with self._lock:
+            if self._buffer and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._buffer:
+                self._flush()
+            if self._file:
+                try:
+                    os.fsync(self._file.fileno())
+                    self._file.close()
+                except OSError as e:
+                    logger.error("%s: error closing capture: %s", self.path, e)
+                self._file = None
+            self.enabled = False
 
-            # Extract ch_index, dest, and sendtext
-            ch_index = query_params.get('ch_index', [None])[0]
-            dest = query_params.get('dest', [None])[0]
-            sendtext = query_params.get('sendtext', [''])[0]
+class CaptureReader:
+    """Memory-mapped capture file. Iterating yields (fields, payload) per record, where fields is a
+    tuple in CAPTURE_FIELDS order; packets() rebuilds packet dicts for replay and columns()
+    pulls every field out into an array for bulk analysis.
 
-            logger.info(f"Received HTTP request: path={self.path}, ch_index={ch_index}, dest={dest}, sendtext={sendtext}")
+    A torn record at the end (the writer was killed mid-batch) ends iteration.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if self._data[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a mesh-replier capture file")
 
-            # Validate request
-            if not interface:
-                logger.error("Meshtastic interface not initialized")
-                self.send_error(500, "Meshtastic interface not initialized")
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def _scan(self):
+        """Yield (offset, fields, payload start, record end) for each complete record."""
+        data = self._data
+        unpack_from = CAPTURE_RECORD.unpack_from
+        header = CAPTURE_RECORD.size
+        offset = len(CAPTURE_MAGIC)
+        end = len(data)
+        while offset + header <= end:
+            fields = unpack_from(data, offset)
+            record_end = offset + 4 + fields[0]
+            if record_end < offset + header or record_end > end:
                 return
-            if not sendtext:
-                logger.error("No sendtext provided")
-                self.send_error(400, "Missing sendtext parameter")
+            yield offset, fields, offset + header, record_end
+            offset = record_end
+
+    def valid_end(self):
+        """Offset just past the last complete record."""
+        end = len(CAPTURE_MAGIC)
+        for _, _, _, end in self._scan():
+            pass
+        return end
+
+    def __iter__(self):
+        data = self._data
+        for _, fields, start, end in self._scan():
+            yield fields[1:], data[start:end]
+
+    def packets(self):
+        """Packet dicts shaped like meshtastic's, with text, telemetry, position and user decoded."""
+        from meshtastic.protobuf import mesh_pb2, telemetry_pb2
+        decoders = {
+            'TEXT_MESSAGE_APP': ('text', lambda payload: payload.decode('utf-8', 'replace')),
+            'TELEMETRY_APP': ('telemetry', partial(_decode_protobuf, telemetry_pb2.Telemetry)),
+            'POSITION_APP': ('position', partial(_decode_protobuf, mesh_pb2.Position)),
+            'NODEINFO_APP': ('user', partial(_decode_protobuf, mesh_pb2.User)),
+        }
+        for (timestamp, pFrom, pTo, packet_id, hop_start, hop_limit, relay_node, channel, snr, rssi, portnum), payload in self:
+            portnum = portnum_name(portnum)
+            decoded = {'portnum': portnum, 'payload': payload}
+            decoder = decoders.get(portnum)
+            if decoder:
+                key, decode = decoder
+                try:
+                    decoded[key] = decode(payload)
+                except Exception:
+                    pass  # leave it undecoded, like meshtastic does
+            packet = {'from': pFrom, 'to': pTo, 'id': packet_id, 'rxTime': int(timestamp), 'hopStart': hop_start,
+                      'hopLimit': hop_limit, 'relayNode': relay_node, 'channel': channel, 'decoded': decoded}
+            if snr == snr:
+                packet['rxSnr'] = round(snr, 2)
+            if rssi:
+                packet['rxRssi'] = rssi
+            yield packet
+
+    def columns(self, fields=CAPTURE_FIELDS):
+        """{field: array} with one entry per record, for the requested fields."""
+        indexes = [CAPTURE_FIELDS.index(field) + 1 for field in fields]
+        columns = [array(CAPTURE_TYPECODES[i - 1]) for i in indexes]
+        appends = [(column.append, i) for column, i in zip(columns, indexes)]
+        for _, record, _, _ in self._scan():
+            for append, i in appends:
+                append(record[i])
+        return dict(zip(fields, columns))
+
+    def node_signal_stats(self):
+        """Per sending node: packet count, direct share and SNR/RSSI summaries over the whole capture."""
+        columns = self.columns(("from", "hop_start", "hop_limit", "snr", "rssi"))
+        nodes = {}
+        for pFrom, hop_start, hop_limit, snr, rssi in zip(*columns.values()):
+            node = nodes.get(pFrom)
+            if node is None:
+                node = nodes[pFrom] = {"packets": 0, "direct": 0, "snr": [], "rssi": []}
+            node["packets"] += 1
+            if hop_start == hop_limit:
+                node["direct"] += 1
+            if snr == snr:
+                node["snr"].append(round(snr, 2))
+            if rssi:
+                node["rssi"].append(rssi)
+        for node in nodes.values():
+            node["direct"] = round(node["direct"] / node["packets"], 3)
+            node["snr"] = summarize(node["snr"])
+            node["rssi"] = summarize(node["rssi"])
+        return nodes
+
+def _decode_protobuf(message_class, payload):
+    from google.protobuf import json_format
+    message = message_class()
+    message.ParseFromString(payload)
+    return json_format.MessageToDict(message)
+
+# Radios to run. Each gets its own receive thread, send queue and airtime budget;
+# the seen-node store is shared so a visitor is only greeted once across all of them.
+RADIO_DEVICES = [
+    {"name": "radio0", "dev_path": "/dev/ttyUSB0", "preset": LORA_PRESET},
+    #{"name": "radio1", "dev_path": "/dev/ttyUSB1", "preset": LORA_PRESET},
+]
+RECEIVE_QUEUE_SIZE = 1024  # packets buffered per radio between the meshtastic callback and its handler thread
+RECONNECT_MIN_DELAY = 2.0  # seconds before retrying a radio that failed to connect or dropped...
+RECONNECT_MAX_DELAY = 120  # ...doubling after each failed attempt, up to this
+
+class Radio:
+    """One SerialInterface plus everything that is per radio: dedupe cache, rate limits,
+    airtime budget, send queue/worker, a receive thread and a connection thread that
+    reconnects with backoff when the serial interface drops."""
+    def __init__(self, name, dev_path=None, preset=LORA_PRESET, capture_path=None):
+        self.name = name
+        self.dev_path = dev_path
+        self.interface = None
+        self.dedupe = DedupeCache()
+        self.ping_limiter = NodeRateLimiter(PING_RATE_LIMIT)
+        self.reply_limiter = NodeRateLimiter(REPLY_RATE_LIMIT)
+        self.command_limiter = NodeRateLimiter(COMMAND_RATE_LIMIT)
+        self.scheduler = TxScheduler(preset)
+        self.send_queue = SendQueue(self.scheduler)
+        self.send_worker = None
+        self.inbound = None
+        self.receive_thread = None
+        self.receive_dropped = 0
+        self.connected = threading.Event()
+        self.connection_thread = None
+        self.reconnects = 0
+        self._lost = threading.Event()
+        self._stopping = threading.Event()
+        self.capture = None
+        if capture_path:
+            self.capture = CaptureWriter(capture_path)
+            self.capture.open()  # here rather than on the receive thread: it may scan an existing file
+        self.metric_labels = (name,)
+        DUPLICATES_DROPPED.set_function(self.metric_labels, lambda: self.dedupe.hits)
+        RECEIVE_DROPPED.set_function(self.metric_labels, lambda: self.receive_dropped)
+        RATE_LIMITED.set_function((name, "ping"), lambda: self.ping_limiter.throttled)
+        RATE_LIMITED.set_function((name, "reply"), lambda: self.reply_limiter.throttled)
+        RATE_LIMITED.set_function((name, "command"), lambda: self.command_limiter.throttled)
+        SEND_QUEUE_DEPTH.set_function(self.metric_labels, lambda: len(self.send_queue))
+        SEND_QUEUE_DROPPED.set_function(self.metric_labels, lambda: self.send_queue.stats["dropped"] + self.send_queue.stats["evicted"])
+        SEND_PREDICTED_WAIT.set_function(self.metric_labels, lambda: round(self.scheduler.predicted_wait(self.send_queue.queued_airtime), 1))
+        AIRTIME_USED.set_function(self.metric_labels, lambda: round(self.scheduler.airtime_used, 3))
+        RADIO_CONNECTED.set_function(self.metric_labels, lambda: int(self.connected.is_set()))
+        RADIO_RECONNECTS.set_function(self.metric_labels, lambda: self.reconnects)
+        if self.capture:
+            CAPTURE_RECORDS.set_function(self.metric_labels, lambda: self.capture.records)
+
+    def attach(self, interface):
+        """Route packets from interface to this radio. Until start() they are handled inline."""
+        self.interface = interface
+        radios[interface] = self
+
+    def connect(self):
+        """Open the serial port and wait for the radio's config download. Raises if it fails."""
+        import meshtastic.serial_interface  # deferred, it pulls in protobuf, pyserial and requests
+        interface = meshtastic.serial_interface.SerialInterface(devPath=self.dev_path, connectNow=False)
+        self.attach(interface)  # before connecting, so packets that arrive during the config download are routed
+        try:
+            interface.connect()
+            interface.waitForConfig()
+        except BaseException:
+            self.disconnect()
+            raise
+        if self.send_worker:
+            self.send_worker.interface = interface
+        self.connected.set()
+
+    def disconnect(self):
+        self.connected.clear()
+        interface = self.interface
+        if interface is None:
+            return
+        radios.pop(interface, None)
+        try:
+            interface.close()
+        except Exception as e:
+            logger.debug("%s: error closing interface: %s", self.name, e)
+
+    def connection_lost(self, interface):
+        """Called when meshtastic reports the interface dropped; the connection thread reconnects."""
+        if interface is self.interface and self.connected.is_set():  # not one we closed ourselves
+            self.connected.clear()
+            self._lost.set()
+
+    def _connection_loop(self):
+        delay = RECONNECT_MIN_DELAY
+        since = _process_start
+        while not self._stopping.is_set():
+            try:
+                self.connect()
+            except Exception as e:
+                logger.error(f"{self.name}: failed to connect to radio on {self.dev_path}: {e}. Retrying in {delay:.0f}s")
+                self._stopping.wait(delay * random.uniform(0.8, 1.2))  # jitter, so radios on one hub don't retry in lockstep
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            if self._stopping.is_set():
+                self.disconnect()
                 return
-            if not (ch_index or dest):
-                logger.error("Neither ch_index nor dest provided")
-                self.send_error(400, "Must provide ch_index or dest")
+            delay = RECONNECT_MIN_DELAY
+            ready = time.monotonic() - since
+            RADIO_READY_SECONDS.set(self.metric_labels, round(ready, 3))
+            if since == _process_start:
+                logger.info(f"{self.name}: ready {ready:.1f}s after start")
+            else:
+                logger.info(f"{self.name}: reconnected, ready {ready:.1f}s after the connection was lost")
+            self._lost.wait()
+            self._lost.clear()
+            if self._stopping.is_set():
                 return
+            since = time.monotonic()
+            self.reconnects += 1
+            logger.warning(f"{self.name}: connection to {self.dev_path} lost, reconnecting")
+            self.disconnect()
+
+    def start(self):
+        """Start the send worker and receive thread, and connect (and keep reconnecting) in the background."""
+        self.send_worker = SendWorker(self.send_queue, self.interface, self.name, self.connected)
+        self.send_worker.start()
+        self.inbound = queue.Queue(RECEIVE_QUEUE_SIZE)
+        self.receive_thread = threading.Thread(target=self._receive_loop, name=f"{self.name}-receiver", daemon=True)
+        self.receive_thread.start()
+        self.connection_thread = threading.Thread(target=self._connection_loop, name=f"{self.name}-connection", daemon=True)
+        self.connection_thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._lost.set()
+        if self.send_worker:
+            self.send_worker.stop()
+        if self.inbound:
+            self.inbound.put(None)
+            self.receive_thread.join(timeout=5)
+        if self.capture:
+            self.capture.close()
+        self.disconnect()
 
-            # Send Meshtastic message
+    def receive(self, packet):
+        """Hand a packet to this radio's handler thread without blocking the caller."""
+        if self.inbound is None:
+            self._handle(packet)
+            return
+        try:
+            self.inbound.put_nowait(packet)
+        except queue.Full:
+            self.receive_dropped += 1
+
+    def _receive_loop(self):
+        while True:
+            packet = self.inbound.get()
+            if packet is None:
+                return
             try:
-                if ch_index:
-                    ch_index = int(ch_index)  # Convert to integer
-                    interface.sendText(sendtext, channelIndex=ch_index, wantAck=True)
-                    logger.info(f"Sent message to channel {ch_index}: {sendtext}")
+                self._handle(packet)
+            except Exception:
+                logger.exception("%s: error handling packet", self.name)
+
+    def _handle(self, packet):
+        start = time.perf_counter()
+        if self.capture:
+            self.capture.write(packet)
+        try:
+            handle_packet(packet, self)
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, self.metric_labels)
+
+    def queue_dm(self, priority, texts, dest, label, coalesce_key=None, on_drop=None):
+        """Queue texts as DMs to dest. Called from the packet handler, never blocks.
+
+        Returns False if the send queue was full. on_drop is called if the message is evicted later.
+        """
+        kwargs = {"destinationId": dest, "wantAck": True, "wantResponse": True, "channelIndex": 0}
+        airtime = sum(self.scheduler.estimate(text) for text in texts)
+        send_queue = self.send_queue
+        message = OutboundMessage(priority, texts, kwargs, coalesce_key, label, airtime)
+        message.on_drop = on_drop
+        if not send_queue.put(message):
+            logger.warning("%s: send queue full (%d), dropped %s to %x", self.name, len(send_queue), label, dest)
+            return False
+        if send_queue.queued_airtime > self.scheduler.burst:
+            logger.info("%s: queued %s to %x, %d waiting, predicted wait %.0fs", self.name, label, dest, len(send_queue), self.scheduler.predicted_wait(send_queue.queued_airtime))
+        return True
+
+    def log_status(self):
+        logger.info(f"{self.name}: send queue {self.send_queue.snapshot()}")
+        logger.info(f"{self.name}: dedupe cache {self.dedupe.snapshot()}, receive drops {self.receive_dropped}")
+        logger.info(f"{self.name}: rate limits ping {self.ping_limiter.snapshot()}, reply {self.reply_limiter.snapshot()}, command {self.command_limiter.snapshot()}")
+        if self.capture:
+            logger.info(f"{self.name}: capture {self.capture.path}: {self.capture.records} records, {self.capture.bytes_written} bytes written")
+
+radios = {}  # interface -> Radio
+heard_packets = DedupeCache()  # (from, packet id) heard by any radio, so per-node stats count a packet once
+
+# Telemetry history. Each node keeps the last TELEMETRY_HISTORY reports per group in fixed-size ring buffers.
+TELEMETRY_HISTORY = 120       # samples kept per node and group
+TELEMETRY_MAX_NODES = 2000    # nodes tracked, least recently reporting are evicted
+TELEMETRY_FIELDS = {
+    'deviceMetrics': ('batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx', 'uptimeSeconds'),
+    'localStats': ('uptimeSeconds', 'channelUtilization', 'airUtilTx', 'numPacketsTx', 'numPacketsRx',
+                   'numPacketsRxBad', 'numOnlineNodes', 'numTotalNodes', 'numRxDupe', 'numTxRelay', 'numTxRelayCanceled'),
+}
+NAN = float('nan')
+
+class TelemetryRing:
+    """Fixed-size ring of (time, field values) rows for one node and group.
+
+    Times are a double array, values a float32 array stored row-major, so a column is an
+    array slice with a stride and all queries run on C-level array/builtin operations.
+    """
+    __slots__ = ("fields", "times", "values", "head", "count")
+
+    def __init__(self, fields, capacity=TELEMETRY_HISTORY):
+        self.fields = fields
+        self.times = array('d', bytes(8 * capacity))
+        self.values = array('f', [NAN]) * (capacity * len(fields))
+        self.head = 0   # next slot to write
+        self.count = 0
+
+    def append(self, timestamp, metrics):
+        width = len(self.fields)
+        capacity = len(self.times)
+        row = self.head * width
+        self.times[self.head] = timestamp
+        for i, field in enumerate(self.fields):
+            value = metrics.get(field)
+            self.values[row + i] = value if isinstance(value, (int, float)) else NAN
+        self.head = (self.head + 1) % capacity
+        if self.count < capacity:
+            self.count += 1
+
+    def _chronological(self, column):
+        """column in oldest-to-newest order."""
+        if self.count < len(self.times):
+            return column[:self.count]
+        return column[self.head:] + column[:self.head]
+
+    def window(self, field, since=0.0, until=float('inf')):
+        """Values of field with since <= time < until, oldest first, missing values skipped."""
+        width = len(self.fields)
+        times = self._chronological(self.times)
+        values = self._chronological(self.values[self.fields.index(field)::width])
+        start = bisect_left(times, since)
+        end = bisect_left(times, until, start)
+        return [value for value in values[start:end] if value == value]
+
+    def latest(self, field):
+        if not self.count:
+            return None
+        value = self.values[((self.head - 1) % len(self.times)) * len(self.fields) + self.fields.index(field)]
+        return value if value == value else None
+
+def summarize(values, percentiles=(50, 90, 99)):
+    """min/max/avg/percentiles of a list of numbers, or None if it's empty."""
+    if not values:
+        return None
+    values = sorted(values)
+    count = len(values)
+    summary = {"count": count, "min": values[0], "max": values[-1], "avg": fsum(values) / count}
+    for p in percentiles:
+        summary[f"p{p}"] = values[min(count - 1, int(p / 100 * count))]
+    return summary
+
+class TelemetryStore:
+    """Per-node telemetry rings with bounded memory (TELEMETRY_MAX_NODES x TELEMETRY_HISTORY samples)."""
+    def __init__(self, max_nodes=TELEMETRY_MAX_NODES, capacity=TELEMETRY_HISTORY):
+        self.max_nodes = max_nodes
+        self.capacity = capacity
+        self._nodes = OrderedDict()  # node_id -> {group: TelemetryRing}
+        self._lock = threading.Lock()
+
+    def record(self, node_id, telemetry, timestamp):
+        """Store the deviceMetrics/localStats of one TELEMETRY_APP packet. Returns False if it had neither."""
+        groups = [(group, fields, telemetry[group]) for group, fields in TELEMETRY_FIELDS.items() if telemetry.get(group)]
+        if not groups:
+            return False
+        with self._lock:
+            rings = self._nodes.get(node_id)
+            if rings is None:
+                rings = self._nodes[node_id] = {}
+                if len(self._nodes) > self.max_nodes:
+                    self._nodes.popitem(last=False)
+            else:
+                self._nodes.move_to_end(node_id)
+            for group, fields, metrics in groups:
+                ring = rings.get(group)
+                if ring is None:
+                    ring = rings[group] = TelemetryRing(fields, self.capacity)
+                ring.append(timestamp, metrics)
+        return True
+
+    def node_stats(self, node_id, field, group='deviceMetrics', seconds=3600):
+        """Summary of one node's field over the last `seconds`."""
+        with self._lock:
+            ring = self._nodes.get(node_id, {}).get(group)
+            values = ring.window(field, time.time() - seconds) if ring else []
+        return summarize(values)
+
+    def venue_stats(self, field, group='deviceMetrics', seconds=3600, latest_only=False):
+        """Summary of a field across all nodes over the last `seconds` (or of each node's latest value)."""
+        since = time.time() - seconds
+        values = []
+        with self._lock:
+            for rings in self._nodes.values():
+                ring = rings.get(group)
+                if ring is None or not ring.count or ring.times[(ring.head - 1) % len(ring.times)] < since:
+                    continue
+                if latest_only:
+                    value = ring.latest(field)
+                    if value is not None:
+                        values.append(value)
                 else:
-                    # Convert dest hex string to integer
-                    dest_id = int(dest, 16)
-                    interface.sendText(sendtext, destinationId=dest_id, wantAck=True)
-                    logger.info(f"Sent message to node {dest}: {sendtext}")
-
-                # Send HTTP response
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(b"Message sent successfully")
-            except ValueError as e:
-                logger.error(f"Invalid ch_index or dest: {e}")
-                self.send_error(400, f"Invalid ch_index or dest: {e}")
-            except Exception as e:
-                logger.error(f"Failed to send Meshtastic message: {e}")
-                self.send_error(500, f"Failed to send message: {e}")
+                    values.extend(ring.window(field, since))
+        return summarize(values)
 
-        except Exception as e:
-            logger.error(f"Error processing HTTP request: {e}")
-            self.send_error(500, f"Internal server error: {e}")
-'''
-def get_node_names(interface, node_id):
-    """Retrieve longName and shortName from NodeDB for a given node ID (integer)."""
+    def __len__(self):
+        return len(self._nodes)
+
+telemetry_store = TelemetryStore()
+
+# Latest position per node with a grid index for "who is near" queries.
+POSITION_GRID_DEG = 0.0025       # grid cell size in degrees (~280 m of latitude)
+POSITION_COARSE_M = 1000         # nodes sharing a position less precise than this aren't put in the grid
+POSITION_MAX_NODES = 20000
+BOOTH_LOCATION = None            # (lat, lon) of the booth; when set, nodes known to be within GREETING_RADIUS_M are greeted even if relayed
+GREETING_RADIUS_M = 500
+METERS_PER_DEG = 111320.0
+
+def precision_meters(precision_bits):
+    """Position uncertainty radius for Meshtastic precision bits (see PRECISION_BITS_MAP). 0 means exact."""
+    if not isinstance(precision_bits, int) or precision_bits <= 0 or precision_bits >= 32:
+        return 0.0
+    return 23300.0 * 2.0 ** (10 - precision_bits)
+
+class PositionStore:
+    """Latest position per node, indexed by grid cell and updated in place on every report.
+
+    Coordinates are kept as the integer latitudeI/longitudeI the radio sends. Queries only
+    visit the cells overlapping the search area, plus the (few) imprecise nodes kept outside
+    the grid.
+    """
+    def __init__(self, cell_deg=POSITION_GRID_DEG, max_nodes=POSITION_MAX_NODES):
+        self.cell = int(cell_deg * 1e7)
+        self.max_nodes = max_nodes
+        self._positions = OrderedDict()  # node_id -> (lat_i, lon_i, altitude, timestamp, uncertainty_m)
+        self._cells = {}                 # (row, col) -> set of node_ids
+        self._coarse = set()
+        self._uncertainties = {}         # uncertainty_m -> gridded nodes with it, to bound how far queries must reach
+        self._lock = threading.Lock()
+
+    def _cell_of(self, lat_i, lon_i):
+        return lat_i // self.cell, lon_i // self.cell
+
+    def _unindex(self, node_id, entry):
+        if entry[4] > POSITION_COARSE_M:
+            self._coarse.discard(node_id)
+            return
+        key = self._cell_of(entry[0], entry[1])
+        cell = self._cells.get(key)
+        if cell is not None:
+            cell.discard(node_id)
+            if not cell:
+                del self._cells[key]
+        remaining = self._uncertainties[entry[4]] - 1
+        if remaining:
+            self._uncertainties[entry[4]] = remaining
+        else:
+            del self._uncertainties[entry[4]]
+
+    def _index(self, node_id, entry):
+        if entry[4] > POSITION_COARSE_M:
+            self._coarse.add(node_id)
+        else:
+            self._cells.setdefault(self._cell_of(entry[0], entry[1]), set()).add(node_id)
+            self._uncertainties[entry[4]] = self._uncertainties.get(entry[4], 0) + 1
+
+    def update(self, node_id, position, timestamp):
+        """Store a POSITION_APP report. Returns False if it carried no coordinates."""
+        lat_i = position.get('latitudeI')
+        lon_i = position.get('longitudeI')
+        if not lat_i and not lon_i:
+            return False
+        entry = (lat_i or 0, lon_i or 0, position.get('altitude'), timestamp, precision_meters(position.get('precisionBits')))
+        with self._lock:
+            old = self._positions.pop(node_id, None)
+            if old is not None:
+                self._unindex(node_id, old)
+            elif len(self._positions) >= self.max_nodes:
+                evicted_id, evicted = self._positions.popitem(last=False)
+                self._unindex(evicted_id, evicted)
+            self._positions[node_id] = entry
+            self._index(node_id, entry)
+        return True
+
+    def get(self, node_id):
+        """(lat, lon, altitude, timestamp, uncertainty_m) in degrees, or None."""
+        entry = self._positions.get(node_id)
+        if entry is None:
+            return None
+        return entry[0] * 1e-7, entry[1] * 1e-7, entry[2], entry[3], entry[4]
+
+    def _candidates(self, lat_min_i, lon_min_i, lat_max_i, lon_max_i):
+        row_min, col_min = self._cell_of(lat_min_i, lon_min_i)
+        row_max, col_max = self._cell_of(lat_max_i, lon_max_i)
+        cells = self._cells
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                cell = cells.get((row, col))
+                if cell:
+                    yield from cell
+        yield from self._coarse
+
+    def nearby(self, lat, lon, radius_m, strict=False, max_age=None):
+        """[(node_id, distance_m, uncertainty_m)] sorted by distance, for nodes whose position may be
+        within radius_m of (lat, lon). With strict, the whole uncertainty circle must be inside."""
+        cos_lat = max(cos(radians(lat)), 0.01)
+        lat_i, lon_i = int(lat * 1e7), int(lon * 1e7)
+        oldest = time.time() - max_age if max_age else None
+        found = []
+        with self._lock:
+            reach = radius_m if strict else radius_m + max(self._uncertainties, default=0)
+            dlat_i = int(reach / METERS_PER_DEG * 1e7)
+            dlon_i = int(reach / (METERS_PER_DEG * cos_lat) * 1e7)
+            positions = self._positions
+            for node_id in self._candidates(lat_i - dlat_i, lon_i - dlon_i, lat_i + dlat_i, lon_i + dlon_i):
+                node_lat_i, node_lon_i, _, timestamp, uncertainty = positions[node_id]
+                if oldest and timestamp < oldest:
+                    continue
+                dy = (node_lat_i - lat_i) * 1e-7 * METERS_PER_DEG
+                dx = (node_lon_i - lon_i) * 1e-7 * METERS_PER_DEG * cos_lat
+                distance = hypot(dx, dy)
+                if (distance + uncertainty if strict else distance - uncertainty) <= radius_m:
+                    found.append((node_id, round(distance, 1), uncertainty))
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def within_bbox(self, lat_min, lon_min, lat_max, lon_max, max_age=None):
+        """Node IDs whose reported position is inside the box."""
+        box = (int(lat_min * 1e7), int(lon_min * 1e7), int(lat_max * 1e7), int(lon_max * 1e7))
+        oldest = time.time() - max_age if max_age else None
+        found = []
+        with self._lock:
+            for node_id in self._candidates(*box):
+                node_lat_i, node_lon_i, _, timestamp, _ = self._positions[node_id]
+                if box[0] <= node_lat_i <= box[2] and box[1] <= node_lon_i <= box[3] and not (oldest and timestamp < oldest):
+                    found.append(node_id)
+        return found
+
+    def is_near(self, node_id, lat, lon, radius_m):
+        """True if node_id's last position is certainly within radius_m of (lat, lon)."""
+        entry = self._positions.get(node_id)
+        if entry is None:
+            return False
+        cos_lat = cos(radians(lat))
+        dy = (entry[0] * 1e-7 - lat) * METERS_PER_DEG
+        dx = (entry[1] * 1e-7 - lon) * METERS_PER_DEG * cos_lat
+        return hypot(dx, dy) + entry[4] <= radius_m
+
+    def __len__(self):
+        return len(self._positions)
+
+position_store = PositionStore()
+
+# Link quality per node, updated in O(1) from every packet: moving (EWMA) and running (Welford)
+# mean/variance of SNR and RSSI, direct vs relayed counts, last relay node and inter-arrival time.
+# Counts and intervals are per packet, however many radios heard it; SNR/RSSI are per receiving radio
+# and only taken from direct packets (on a relayed packet they describe the last hop, not the sender).
+LINK_EWMA_ALPHA = 0.2     # weight of the newest sample in the moving averages
+LINK_MAX_NODES = 20000    # nodes tracked, least recently heard are evicted
+
+class RunningStats:
+    """Count, last value, EWMA and Welford mean/variance of a stream, in constant memory."""
+    __slots__ = ("count", "last", "ewma", "mean", "m2")
+
+    def __init__(self):
+        self.count = 0
+        self.last = self.ewma = self.mean = self.m2 = 0.0
+
+    def add(self, value, alpha=LINK_EWMA_ALPHA):
+        self.count += 1
+        self.last = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.ewma = value if self.count == 1 else self.ewma + alpha * (value - self.ewma)
+
+    @property
+    def stddev(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+    def snapshot(self, digits=2):
+        if not self.count:
+            return None
+        return {"count": self.count, "last": self.last, "ewma": round(self.ewma, digits),
+                "mean": round(self.mean, digits), "stddev": round(self.stddev, digits)}
+
+class LinkStats:
+    __slots__ = ("packets", "direct", "relay_node", "first_heard", "last_heard", "interval", "signal")
+
+    def __init__(self, timestamp):
+        self.packets = 0
+        self.direct = 0
+        self.relay_node = None
+        self.first_heard = self.last_heard = timestamp
+        self.interval = RunningStats()  # seconds between packets
+        self.signal = {}  # radio name -> (SNR, RSSI) RunningStats
+
+    def snapshot(self):
+        return {"packets": self.packets, "direct_ratio": round(self.direct / self.packets, 3) if self.packets else None,
+                "relay_node": self.relay_node, "first_heard": self.first_heard, "last_heard": self.last_heard,
+                "interval": self.interval.snapshot(1),
+                "radios": {radio: {"snr": snr.snapshot(), "rssi": rssi.snapshot()} for radio, (snr, rssi) in self.signal.items()}}
+
+class LinkStore:
+    """Per-node LinkStats with bounded memory (LINK_MAX_NODES entries, each sized by the number of radios)."""
+    def __init__(self, max_nodes=LINK_MAX_NODES, alpha=LINK_EWMA_ALPHA):
+        self.max_nodes = max_nodes
+        self.alpha = alpha
+        self._nodes = OrderedDict()  # node_id -> LinkStats, least recently heard first
+        self._lock = threading.Lock()
+
+    def record(self, node_id, radio_name, packet, direct, timestamp, first=True):
+        """Add one packet from node_id as heard by radio_name, direct or relayed. first is False when
+        another radio already heard this packet: it then only adds to this radio's SNR/RSSI."""
+        with self._lock:
+            stats = self._nodes.get(node_id)
+            if stats is None:
+                stats = self._nodes[node_id] = LinkStats(timestamp)
+                if len(self._nodes) > self.max_nodes:
+                    self._nodes.popitem(last=False)
+                first = True
+            elif first:
+                self._nodes.move_to_end(node_id)
+                stats.interval.add(max(timestamp - stats.last_heard, 0), self.alpha)
+            if first:
+                stats.packets += 1
+                stats.last_heard = timestamp
+                if direct:
+                    stats.direct += 1
+                else:
+                    stats.relay_node = packet.get('relayNode')
+            if direct and ('rxSnr' in packet or 'rxRssi' in packet):
+                signal = stats.signal.get(radio_name)
+                if signal is None:
+                    signal = stats.signal[radio_name] = (RunningStats(), RunningStats())
+                if 'rxSnr' in packet:
+                    signal[0].add(packet['rxSnr'], self.alpha)
+                if 'rxRssi' in packet:
+                    signal[1].add(packet['rxRssi'], self.alpha)
+
+    def get(self, node_id):
+        with self._lock:
+            stats = self._nodes.get(node_id)
+            return stats.snapshot() if stats else None
+
+    def export(self, since=0):
+        """{node_id: snapshot} for every node heard at or after `since`."""
+        with self._lock:
+            return {node_id: stats.snapshot() for node_id, stats in self._nodes.items() if stats.last_heard >= since}
+
+    def __len__(self):
+        return len(self._nodes)
+
+link_store = LinkStore()
+
+# Node name cache, so the NodeDB is only consulted when a node is new or its info changed.
+NAME_CACHE_SIZE = 20000
+NAME_NEGATIVE_TTL = 300   # seconds before an unknown node is looked up in the NodeDB again
+
+def nodedb_names(interface, node_id):
+    """(longName, shortName) from the NodeDB, or None if the node has no user info yet."""
     node = interface.nodes.get(f"!{node_id:08x}", None)
     if node and 'user' in node:
-        long_name = node['user'].get('longName', 'Unknown')
-        short_name = node['user'].get('shortName', 'UNK')
-        return long_name, short_name
+        NODEDB_LOOKUPS.inc(("hit",))
+        return node['user'].get('longName', 'Unknown'), node['user'].get('shortName', 'UNK')
+    NODEDB_LOOKUPS.inc(("miss",))
+    return None
+
+def fallback_names(node_id):
     hex_id = f"{node_id:08x}"[-4:]
     return f"Meshtastic {hex_id}", hex_id
 
+class NameCache:
+    """Node names by integer node ID.
+
+    Known names are cached until a NODEINFO_APP packet or NodeDB update replaces them. Nodes
+    without NodeInfo get a negative entry (holding the fallback names) that expires after
+    NAME_NEGATIVE_TTL, so they are retried now and then instead of on every packet.
+    """
+    def __init__(self, size=NAME_CACHE_SIZE, negative_ttl=NAME_NEGATIVE_TTL):
+        self.size = size
+        self.negative_ttl = negative_ttl
+        self._names = {}  # node_id -> (long_name, short_name, expires); expires is None for known names
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def _store(self, node_id, long_name, short_name, expires):
+        names = self._names
+        if node_id not in names and len(names) >= self.size:
+            names.pop(next(iter(names)), None)  # oldest inserted
+        names[node_id] = (long_name, short_name, expires)
+
+    def get(self, interface, node_id):
+        entry = self._names.get(node_id)
+        if entry is not None:
+            if entry[2] is None:
+                self.hits += 1
+                return entry[0], entry[1]
+            if entry[2] > time.monotonic():
+                self.negative_hits += 1
+                return entry[0], entry[1]
+        self.misses += 1
+        try:
+            names = nodedb_names(interface, node_id)
+        except Exception as e:
+            logger.error("Error getting node names for %x: %s", node_id, e)
+            return f"Unknown_{node_id:x}", f"UNK_{node_id:x}"
+        if names is not None:
+            self._store(node_id, names[0], names[1], None)
+            return names
+        long_name, short_name = fallback_names(node_id)
+        self._store(node_id, long_name, short_name, time.monotonic() + self.negative_ttl)
+        return long_name, short_name
+
+    def update(self, node_id, user):
+        """Take names from a NODEINFO_APP user payload or NodeDB user entry."""
+        if user and ('longName' in user or 'shortName' in user):
+            self._store(node_id, user.get('longName', 'Unknown'), user.get('shortName', 'UNK'), None)
+        else:
+            self.invalidate(node_id)
+
+    def invalidate(self, node_id):
+        self._names.pop(node_id, None)
+
+    def snapshot(self):
+        total = self.hits + self.negative_hits + self.misses
+        return {"hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses, "size": len(self._names),
+                "hit_ratio": round((self.hits + self.negative_hits) / total, 3) if total else 0.0}
+
+name_cache = NameCache()
+
+# DM commands. The first word of a DM is looked up in a prefix table built once at startup.
+CANNED_REPLY = "I'm just a bot. If you need assitance contact Trevor KG6MDW on the BAYME.sh discord."
+COMMAND_MIN_PREFIX = 3    # shortest unambiguous prefix accepted for a command ("sig" -> signal); 2 would catch "no", "in", ...
+COMMAND_WORKERS = 2       # threads for commands that shouldn't run on the receive thread
+
+class CommandContext:
+    """What a command handler gets: the packet, the radio it came in on, the sender and the rest of the DM."""
+    __slots__ = ("packet", "radio", "sender", "relay_info", "args")
+
+    def __init__(self, packet, radio, sender, relay_info, args):
+        self.packet = packet
+        self.radio = radio
+        self.sender = sender
+        self.relay_info = relay_info
+        self.args = args
+
+class Command:
+    __slots__ = ("name", "handler", "render", "priority", "limiter", "inline", "help")
+
+    def __init__(self, name, handler, template, priority, limiter, inline, help_text):
+        self.name = name
+        self.handler = handler
+        self.render = template.format  # bound once, so a reply is a single format call
+        self.priority = priority
+        self.limiter = limiter
+        self.inline = inline
+        self.help = help_text
+
+class CommandDispatcher:
+    """Table-driven DM commands.
+
+    Each command is registered with a reply template and a handler returning the template's
+    fields. Lookup is one dict access on the DM's first word, whatever the number of commands.
+    Commands registered with inline=False run on a small thread pool so they never hold up
+    packet handling.
+    """
+    def __init__(self, workers=COMMAND_WORKERS):
+        self.commands = {}
+        self._prefixes = {}
+        self._executor = None
+        self._workers = workers
+
+    def register(self, name, template, priority=PRIO_REPLY, limiter="command_limiter", inline=True, help_text="", aliases=()):
+        """Decorator: @commands.register("ping", "pong {timestamp}...") over handler(ctx) -> dict."""
+        def decorator(handler):
+            command = Command(name, handler, template, priority, limiter, inline, help_text)
+            for key in (name,) + tuple(aliases):
+                self.commands[key] = command
+            self._build_prefixes()
+            return handler
+        return decorator
+
+    def _build_prefixes(self):
+        owners = {}
+        for key, command in self.commands.items():
+            for end in range(COMMAND_MIN_PREFIX, len(key) + 1):
+                owners.setdefault(key[:end], set()).add(command)
+        prefixes = {prefix: next(iter(found)) for prefix, found in owners.items() if len(found) == 1}
+        prefixes.update(self.commands)  # full names always win
+        self._prefixes = prefixes
+
+    def lookup(self, text):
+        """(command, args) for a DM, or (None, text) if it isn't a command."""
+        word, _, args = text.strip().partition(' ')
+        return self._prefixes.get(word.lower()), args.strip()
+
+    def dispatch(self, text, packet, radio, sender, relay_info):
+        command, args = self.lookup(text)
+        if command is None:
+            if not radio.reply_limiter.allow(sender):
+                logger.info("Message from %x rate limited, not replying", sender)
+                return
+            logger.info("It's a some other message. Replying with canned responce")
+            radio.queue_dm(PRIO_REPLY, [CANNED_REPLY], sender, "automessage", coalesce_key=("reply", sender))
+            return
+        if not getattr(radio, command.limiter).allow(sender):
+            logger.info("%s from %x rate limited, not replying", command.name, sender)
+            return
+        ctx = CommandContext(packet, radio, sender, relay_info, args)
+        if command.inline:
+            self._run(command, ctx)
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="mesh-command")
+            self._executor.submit(self._run, command, ctx)
+
+    def _run(self, command, ctx):
+        try:
+            msg = command.render(**command.handler(ctx))
+        except Exception as e:
+            logger.error("Command %s from %x failed: %s", command.name, ctx.sender, e)
+            return
+        logger.info("It's a %s command. Replying with %s", command.name, msg)
+        ctx.radio.queue_dm(command.priority, [msg], ctx.sender, command.name, coalesce_key=(command.name, ctx.sender))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+commands = CommandDispatcher()
+
+@commands.register("ping", "pong {timestamp}. rxSNR {snr} dB RSSI {rssi} dBm ({relay_info})",
+                   priority=PRIO_PONG, limiter="ping_limiter", help_text="signal report of your ping")
+def command_ping(ctx):
+    # Format timestamp to show only seconds
+    return {"timestamp": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "snr": ctx.packet.get('rxSnr', '?'), "rssi": ctx.packet.get('rxRssi', '?'), "relay_info": ctx.relay_info}
+
+@commands.register("signal", "{name}: rxSNR {snr} dB RSSI {rssi} dBm ({relay_info}). "
+                   "{packets} pkts, {direct}% direct, avg SNR {snr_avg}±{snr_sd} dB RSSI {rssi_avg} dBm",
+                   help_text="how we hear you")
+def command_signal(ctx):
+    link = link_store.get(ctx.sender)  # includes this DM
+    signal = link["radios"].get(ctx.radio.name, {}) if link else {}
+    snr, rssi = signal.get("snr"), signal.get("rssi")
+    return {"name": name_cache.get(ctx.radio.interface, ctx.sender)[1], "snr": ctx.packet.get('rxSnr', '?'),
+            "rssi": ctx.packet.get('rxRssi', '?'), "relay_info": ctx.relay_info,
+            "packets": link["packets"] if link else 0, "direct": round(100 * link["direct_ratio"]) if link else "?",
+            "snr_avg": round(snr["ewma"], 1) if snr else "?", "snr_sd": round(snr["stddev"], 1) if snr else "?",
+            "rssi_avg": round(rssi["ewma"]) if rssi else "?"}
+
+@commands.register("info", "{canned}", help_text="who runs this bot")
+def command_info(ctx):
+    return {"canned": CANNED_REPLY}
+
+@commands.register("nodes", "Greeted {seen} nodes, {positions} with a position, {near} near the booth.",
+                   inline=False, help_text="node counts")
+def command_nodes(ctx):
+    near = len(position_store.nearby(*BOOTH_LOCATION, GREETING_RADIUS_M)) if BOOTH_LOCATION else "?"
+    return {"seen": len(seen_nodes), "positions": len(position_store), "near": near}
+
+@commands.register("help", "Commands: {names}", help_text="this list", aliases=("?", "commands"))
+def command_help(ctx):
+    names = sorted({command.name for command in commands.commands.values()})
+    return {"names": ", ".join(names)}
+
+# Greeting for nodes not greeted before: GREETING_DIRECT when we heard them directly, GREETING_NEARBY
+# when their packet was relayed but their position puts them near the booth. GREETING_FOLLOWUP goes after either.
+GREETING_DIRECT = "Hello, It looks like your at Pacificon. I saw a packet from you directly. We are using a special event settings at Pacificon, You can get them here: https://www.pacificon.org/events/meshtastic"
+GREETING_NEARBY = "Hello, It looks like your at Pacificon. Your position shows you near our booth. We are using a special event settings at Pacificon, You can get them here: https://www.pacificon.org/events/meshtastic"
+GREETING_FOLLOWUP = "The rest of the SF Bay area uses Medium Slow. IF you would like to join our mesh after Pacificon, check us out at https://bayme.sh "
+
 def onReceive(packet, interface):  # called when a packet arrives
-    global nodelist
-    now = datetime.datetime.now()
-    timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-    #logger.info(f"{timestamp} received: {packet}")
-   
+    radio = radios.get(interface)
+    if radio is not None:
+        radio.receive(packet)
+
+def handle_packet(packet, radio):  # runs on the radio's receive thread
+    interface = radio.interface
     pFrom = packet['from']
     pTo = packet['to']
-    
-    # Get node names
-    try:
-        from_long_name, from_short_name = get_node_names(interface, pFrom)
-    except Exception as e:
-        logger.error(f"Error getting node names for {pFrom:x}: {e}")
-        from_long_name, from_short_name = f"Unknown_{pFrom:x}", f"UNK_{pFrom:x}"
+
+    # Drop rebroadcasts/retransmissions of a packet we've already handled
+    packet_id = packet.get('id')
+    if packet_id and radio.dedupe.seen((pFrom, packet_id)):
+        return
+    first = not (packet_id and heard_packets.seen((pFrom, packet_id)))  # False if another radio heard it too
+
+    #logger.debug("received: %s", packet)
+
+    # Get node names, refreshing the cache first if this packet is the node's NodeInfo
+    decoded = packet.get('decoded')  # missing if meshtastic couldn't decrypt it (e.g. a private channel)
+    if decoded and decoded.get('portnum') == 'NODEINFO_APP':
+        name_cache.update(pFrom, decoded.get('user'))
+    from_long_name, from_short_name = name_cache.get(interface, pFrom)
     
     # Check if packet was received directly or relayed
     hop_start = packet.get('hopStart', 0)
     hop_limit = packet.get('hopLimit', 0)
     relay_node = packet.get('relayNode', 0)
     
-    # Prepare SNR and RSSI if both exist
-    signal_info = ""
-    if 'rxSnr' in packet and 'rxRssi' in packet:
-        signal_info = f", SNR: {packet['rxSnr']} dB, RSSI: {packet['rxRssi']} dBm"
-    
     if hop_start == hop_limit and pFrom != interface.myInfo.my_node_num:
-        logger.info(f"{timestamp} Direct packet received. From {pFrom:x} ({from_long_name}/{from_short_name}) to {pTo:x}, relayNode: {relay_node} (0x{relay_node:x}){signal_info}")
+        # Add SNR and RSSI if both exist
+        if 'rxSnr' in packet and 'rxRssi' in packet:
+            logger.info("Direct packet received. From %x (%s/%s) to %x, relayNode: %d (0x%x), SNR: %s dB, RSSI: %s dBm",
+                        pFrom, from_long_name, from_short_name, pTo, relay_node, relay_node, packet['rxSnr'], packet['rxRssi'])
+        else:
+            logger.info("Direct packet received. From %x (%s/%s) to %x, relayNode: %d (0x%x)",
+                        pFrom, from_long_name, from_short_name, pTo, relay_node, relay_node)
         relay_info = "direct"
     else:
-        #logger.info(f"{timestamp} Relayed packet received. From {pFrom:x} ({from_long_name}/{from_short_name}) to {pTo:x}, relayNode: {relay_node} (0x{relay_node:x}){signal_info}")
+        #logger.debug("Relayed packet received. From %x (%s/%s) to %x, relayNode: %d (0x%x)", pFrom, from_long_name, from_short_name, pTo, relay_node, relay_node)
         relay_info = f"relayed via {relay_node:x}"
+    if pFrom != interface.myInfo.my_node_num:
+        link_store.record(pFrom, radio.name, packet, relay_info == "direct", packet.get('rxTime') or time.time(), first)
 
     # Handle telemetry packets
-    portnum = packet['decoded'].get('portnum', 'UNKNOWN')
+    portnum = decoded.get('portnum', 'UNKNOWN') if decoded is not None else 'ENCRYPTED'
+    PACKETS_RECEIVED.inc((radio.name, portnum, "direct" if relay_info == "direct" else "relayed"))
+    if decoded is None:
+        return  # counted and in the link stats, nothing else to do with it
 
-    '''
     if portnum == 'TELEMETRY_APP':
         telemetry = packet['decoded'].get('telemetry', {})
-        
-        # Handle deviceMetrics (battery, voltage, etc.)
-        device_metrics = telemetry.get('deviceMetrics', {})
-        if device_metrics:
-            logger.info(f"Telemetry (Device Metrics) from {pFrom:x} ({from_long_name}/{from_short_name}):")
-            logger.info(f"  Battery Level: {device_metrics.get('batteryLevel', 'N/A')} %")
-            logger.info(f"  Voltage: {device_metrics.get('voltage', 'N/A')} V")
-            channel_util = device_metrics.get('channelUtilization', 'N/A')
-            air_util = device_metrics.get('airUtilTx', 'N/A')
-            logger.info(f"  Channel Utilization: {channel_util:.2f} %" if isinstance(channel_util, (int, float)) else f"  Channel Utilization: {channel_util} %")
-            logger.info(f"  Air Utilization TX: {air_util:.2f} %" if isinstance(air_util, (int, float)) else f"  Air Utilization TX: {air_util} %")
-            uptime_seconds = device_metrics.get('uptimeSeconds', 'N/A')
-            uptime_hours = uptime_seconds / 3600 if isinstance(uptime_seconds, (int, float)) else 'N/A'
-            logger.info(f"  Uptime: {uptime_seconds} seconds ({uptime_hours:.2f} hours)" if isinstance(uptime_seconds, (int, float)) else f"  Uptime: {uptime_seconds}")
-        
-        # Handle localStats (network statistics)
-        local_stats = telemetry.get('localStats', {})
-        if local_stats:
-            logger.info(f"Telemetry (Local Stats) from {pFrom:x} ({from_long_name}/{from_short_name}):")
-            uptime_seconds = local_stats.get('uptimeSeconds', 'N/A')
-            uptime_hours = uptime_seconds / 3600 if isinstance(uptime_seconds, (int, float)) else 'N/A'
-            logger.info(f"  Uptime: {uptime_seconds} seconds ({uptime_hours:.2f} hours)" if isinstance(uptime_seconds, (int, float)) else f"  Uptime: {uptime_seconds}")
-            channel_util = local_stats.get('channelUtilization', 'N/A')
-            air_util = local_stats.get('airUtilTx', 'N/A')
-            logger.info(f"  Channel Utilization: {channel_util:.2f} %" if isinstance(channel_util, (int, float)) else f"  Channel Utilization: {channel_util} %")
-            logger.info(f"  Air Utilization TX: {air_util:.2f} %" if isinstance(air_util, (int, float)) else f"  Air Utilization TX: {air_util} %")
-            logger.info(f"  Packets TX: {local_stats.get('numPacketsTx', 'N/A')}")
-            logger.info(f"  Packets RX: {local_stats.get('numPacketsRx', 'N/A')}")
-            logger.info(f"  Packets RX Bad: {local_stats.get('numPacketsRxBad', 'N/A')}")
-            logger.info(f"  Online Nodes: {local_stats.get('numOnlineNodes', 'N/A')}")
-            logger.info(f"  Total Nodes: {local_stats.get('numTotalNodes', 'N/A')}")
-            logger.info(f"  RX Duplicates: {local_stats.get('numRxDupe', 'N/A')}")
-            logger.info(f"  TX Relay: {local_stats.get('numTxRelay', 'N/A')}")
-            logger.info(f"  TX Relay Canceled: {local_stats.get('numTxRelayCanceled', 'N/A')}")
-        
-        if not device_metrics and not local_stats:
-            logger.info(f"Telemetry from {pFrom:x} ({from_long_name}/{from_short_name}): No device metrics or local stats available")
+        if not first:
+            logger.debug("Telemetry from %x (%s/%s) already stored from another radio", pFrom, from_long_name, from_short_name)
+        elif telemetry_store.record(pFrom, telemetry, packet.get('rxTime') or time.time()):
+            logger.debug("Telemetry from %x (%s/%s) stored", pFrom, from_long_name, from_short_name)
+        else:
+            logger.debug("Telemetry from %x (%s/%s): No device metrics or local stats available", pFrom, from_long_name, from_short_name)
         return  # Skip further processing for telemetry packets
 
     # Handle position packets
     if portnum == 'POSITION_APP':
         position = packet['decoded'].get('position', {})
-        latitude = position.get('latitudeI', 0) * 1e-7 if position.get('latitudeI') else 'N/A'
-        longitude = position.get('longitudeI', 0) * 1e-7 if position.get('longitudeI') else 'N/A'
-        altitude = position.get('altitude', 'N/A')
-        time_unix = position.get('time', 0)
-        time_formatted = datetime.datetime.fromtimestamp(time_unix).strftime('%Y-%m-%d %H:%M:%S') if time_unix > 0 else 'N/A'
-        ground_speed = position.get('groundSpeed', 'N/A')
-        ground_track = position.get('groundTrack', 0) * 1e-5 if 'groundTrack' in position else 'N/A'
-        sats_in_view = position.get('satsInView', 'N/A')
-        pdop = position.get('PDOP', 0) * 0.01 if 'PDOP' in position else 'N/A'
-        precision_bits = position.get('precisionBits', 'N/A')
-        location_source = position.get('locationSource', 'N/A')
-        # Get precision uncertainty
-        precision_info = PRECISION_BITS_MAP.get(precision_bits, {"metric": "N/A", "imperial": "N/A"}) if isinstance(precision_bits, int) else {"metric": "N/A", "imperial": "N/A"}
-        precision_text = f"±{precision_info['metric']} (±{precision_info['imperial']}) for {precision_bits} bits" if precision_info['metric'] != "N/A" else "N/A"
-        
-        logger.info(f"Position report from {pFrom:x} ({from_long_name}/{from_short_name}):")
-        logger.info(f"  Latitude: {latitude} degrees" if isinstance(latitude, (int, float)) else f"  Latitude: {latitude}")
-        logger.info(f"  Longitude: {longitude} degrees" if isinstance(longitude, (int, float)) else f"  Longitude: {longitude}")
-        logger.info(f"  Altitude: {altitude} meters" if isinstance(altitude, (int, float)) else f"  Altitude: {altitude}")
-        logger.info(f"  Time: {time_formatted}")
-        logger.info(f"  Ground Speed: {ground_speed} m/s" if isinstance(ground_speed, (int, float)) else f"  Ground Speed: {ground_speed}")
-        logger.info(f"  Ground Track: {ground_track:.2f} degrees" if isinstance(ground_track, (int, float)) else f"  Ground Track: {ground_track}")
-        logger.info(f"  Satellites in View: {sats_in_view}")
-        logger.info(f"  PDOP: {pdop:.2f}" if isinstance(pdop, (int, float)) else f"  PDOP: {pdop}")
-        logger.info(f"  Precision: {precision_text}")
-        logger.info(f"  Location Source: {location_source}")
+        if position_store.update(pFrom, position, packet.get('rxTime') or time.time()) and logger.isEnabledFor(logging.DEBUG):
+            precision_info = PRECISION_BITS_MAP.get(position.get('precisionBits'), {"metric": "N/A"})
+            logger.debug("Position report from %x (%s/%s): %.5f, %.5f ±%s", pFrom, from_long_name, from_short_name,
+                         position.get('latitudeI', 0) * 1e-7, position.get('longitudeI', 0) * 1e-7, precision_info['metric'])
         return  # Skip further processing for position packets
-'''
+
     # Handle all text message packets
     if portnum == 'TEXT_MESSAGE_APP':
         text = packet['decoded'].get('text', '')
         channel = packet.get('channel', 'N/A')
         
-        logger.info(f"Text message from {pFrom:x} ({from_long_name}/{from_short_name}) to {pTo:x} on channel {channel}: {text}")
-        print(f"Relayinfo: {relay_info}")
+        logger.info("Text message from %x (%s/%s) to %x on channel %s: %s", pFrom, from_long_name, from_short_name, pTo, channel, text)
+        logger.debug("Relayinfo: %s", relay_info)
 
         if pTo == interface.myInfo.my_node_num:
-            print(text.strip().lower())
-            if text.strip().lower() == "ping":  # Use b'ping' for byte string comparison
-                # Format timestamp to show only seconds
-                timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-                msg = f"pong {timestamp}. rxSNR {packet['rxSnr']} dB RSSI {packet['rxRssi']} dBm ({relay_info})"
-                logger.info(f"It's a ping packet. Replying with {msg}")
-                try:
-                    interface.sendText(msg, destinationId=pFrom, wantAck=True, wantResponse=True, channelIndex=0)
-                except Exception as e:
-                    logger.error(f"Failed to send pong: {e}")
-                
-            else:
-                # Format timestamp to show only seconds
-                timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-                msg = "I'm just a bot. If you need assitance contact Trevor KG6MDW on the BAYME.sh discord."
-                logger.info(f"It's a some other message. Replying with canned responce")
-                try:
-                    interface.sendText(msg, destinationId=pFrom, wantAck=True, wantResponse=True, channelIndex=0)
-
-                except Exception as e:
-                    logger.error(f"Failed to send automessage: {e}")
+            commands.dispatch(text, packet, radio, pFrom, relay_info)
 
         else:    
         # Do a responce if the node is not in the local DB.
-            if pFrom not in nodelist and relay_info == "direct" : 
-                #add it to the list
-                nodelist.append(pFrom)
-                with open("messagednodes.txt", "w") as f:
-                    for node_id in nodelist:
-                        f.write(f"{node_id}\n")
-
-                logger.info(f"We heard a packet from a node not in our database. Replying with with automated message")
-                msg = f"Hello, It looks like your at Pacificon. I saw a packet from you directly. We are using a special event settings at Pacificon, You can get them here: https://www.pacificon.org/events/meshtastic"
-                try:
-                    interface.sendText(msg, destinationId=pFrom, wantAck=True, wantResponse=True, channelIndex=0)
+            near_booth = BOOTH_LOCATION is not None and position_store.is_near(pFrom, *BOOTH_LOCATION, GREETING_RADIUS_M)
+            if (relay_info == "direct" or near_booth) and seen_nodes.add(pFrom):
 
-                except Exception as e:
-                    logger.info(f"Failed to send message: {e}")
+                logger.info("We heard a packet from a node not in our database. Replying with with automated message")
+                greeting = GREETING_DIRECT if relay_info == "direct" else GREETING_NEARBY
+                # The node was marked greeted above, so another radio hearing it doesn't greet it too;
+                # un-mark it if the greeting doesn't make it out of the send queue.
+                forget = partial(seen_nodes.discard, pFrom)
+                if not radio.queue_dm(PRIO_GREETING, [greeting, GREETING_FOLLOWUP], pFrom, "greeting",
+                                      coalesce_key=("greeting", pFrom), on_drop=forget):
+                    forget()
+            else:
+                logger.info("Not a 0-hop message or node already in database. Ignoring")
 
-                msg = f"The rest of the SF Bay area uses Medium Slow. IF you would like to join our mesh after Pacificon, check us out at https://bayme.sh "
-                try:
-                    interface.sendText(msg, destinationId=pFrom, wantAck=True, wantResponse=True, channelIndex=0)
+# HTTP send API. Requests are answered as soon as the messages are queued; delivery is tracked per job.
+HTTP_ENABLED = False
+HTTP_HOST = '::'
+HTTP_PORT = 8080
+HTTP_KEEPALIVE_TIMEOUT = 30   # seconds an idle keep-alive connection is held open
+HTTP_MAX_BODY = 256 * 1024
+HTTP_MAX_TARGETS = 1000       # destinations/channels accepted in one request
+HTTP_JOBS_KEPT = 1000         # finished jobs remembered for /status
 
-                except Exception as e:
-                    logger.error(f"Failed to send message: {e}")
+class Delivery:
+    """State of one message to one destination or channel: queued, sent, acked, nak, failed or dropped."""
+    __slots__ = ("target", "radio", "state", "packet_id", "error", "updated")
+
+    def __init__(self, target, radio):
+        self.target = target
+        self.radio = radio
+        self.state = "queued"
+        self.packet_id = None
+        self.error = None
+        self.updated = time.time()
+
+    def _set(self, state, error=None):
+        self.state = state
+        self.error = error
+        self.updated = time.time()
+
+    def sent(self, packet):
+        self.packet_id = getattr(packet, "id", None)
+        if self.state == "queued":  # the ack can beat us here
+            self._set("sent")
+
+    def failed(self, error):
+        self._set("failed", str(error))
+
+    def dropped(self, reason):
+        self._set("dropped", reason)
+
+    def ack_callback(self):
+        """onResponse callback for sendText. meshtastic only passes plain ACKs to callbacks named onAckNak."""
+        def onAckNak(packet):
+            reason = packet.get('decoded', {}).get('routing', {}).get('errorReason', 'NONE')
+            if reason == 'NONE':
+                self._set("acked")
             else:
-                logger.info(f"Not a 0-hop message or node already in database. Ignoring")
-
-       
-'''
-    # Handle text message packets addressed to this node
-    if pTo == interface.myInfo.my_node_num:
-        logger.info(f"Packet is for me! It's from {pFrom:x} ({from_long_name}/{from_short_name})")
-        # Decode payload and check portnum
-        payload = packet['decoded'].get('payload', b'')
-        logger.info(f"Portnum: {portnum}, Payload (hex): {binascii.hexlify(payload).decode()}")
-        
-        # Check for ping (case-sensitive by default)
-        if portnum == 'TEXT_MESSAGE_APP' and payload == b'ping':  # Use b'ping' for byte string comparison
-            # Format timestamp to show only seconds
-            timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-            msg = f"pong {timestamp}. rxSNR {packet['rxSnr']} dB RSSI {packet['rxRssi']} dBm ({relay_info})"
-            logger.info(f"It's a ping packet. Replying with {msg}")
+                self._set("nak", reason)
+        return onAckNak
+
+    def as_dict(self):
+        return {"target": self.target, "radio": self.radio, "state": self.state,
+                "packet_id": self.packet_id, "error": self.error, "updated": self.updated}
+
+class JobTracker:
+    """Recent HTTP send jobs by id, oldest forgotten first."""
+    def __init__(self, keep=HTTP_JOBS_KEPT):
+        self.keep = keep
+        self._jobs = OrderedDict()
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def new_job(self, deliveries):
+        with self._lock:
+            job_id = self._next_id
+            self._next_id += 1
+            self._jobs[job_id] = (time.time(), deliveries)
+            if len(self._jobs) > self.keep:
+                self._jobs.popitem(last=False)
+            return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        created, deliveries = job
+        counts = {}
+        for delivery in deliveries:
+            counts[delivery.state] = counts.get(delivery.state, 0) + 1
+        return {"job": job_id, "created": created, "counts": counts, "deliveries": [d.as_dict() for d in deliveries]}
+
+http_jobs = JobTracker()
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def parse_dest(dest):
+    """Node ID from an int, "!abcd1234" or a bare hex string."""
+    if isinstance(dest, int):
+        return dest
+    return int(str(dest).lstrip('!'), 16)
+
+def pick_radios(name=None):
+    """Running radios (or the one called name), in RADIO_DEVICES order."""
+    order = {config["name"]: i for i, config in enumerate(RADIO_DEVICES)}
+    running = sorted((radio for radio in radios.values() if radio.send_worker), key=lambda radio: order.get(radio.name, len(order)))
+    if name is not None:
+        running = [radio for radio in running if radio.name == name]
+    if not running:
+        raise HTTPError(503, f"No radio {name} running" if name else "Meshtastic interface not initialized")
+    return running
+
+def target_list(value, name):
+    """dests/channels as a list. Accepts a list or a single value; strings are split on commas
+    (so ?dest=a,b and form bodies work). Anything else is a 400."""
+    if value is None:
+        return []
+    targets = []
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, bool) or not isinstance(item, (str, int)):
+            raise HTTPError(400, f"{name} must be a node ID/channel or a list of them")
+        if isinstance(item, str):
+            targets += [part.strip() for part in item.split(',') if part.strip()]
+        else:
+            targets.append(item)
+    return targets
+
+def queue_announcements(text, dests, channels, to_radios):
+    """Queue text to each dest (DM) and channel (broadcast) and return the job id."""
+    if not text:
+        raise HTTPError(400, "Missing text")
+    if not (dests or channels):
+        raise HTTPError(400, "Must provide dest(s) or channel(s)")
+    if len(dests) + len(channels) > HTTP_MAX_TARGETS:
+        raise HTTPError(400, f"At most {HTTP_MAX_TARGETS} destinations and channels per request")
+    try:
+        dests = [parse_dest(dest) for dest in dests]
+        channels = [int(ch) for ch in channels]
+    except ValueError as e:
+        raise HTTPError(400, f"Invalid ch_index or dest: {e}")
+    for dest in dests:
+        if not 0 <= dest <= 0xffffffff:
+            raise HTTPError(400, f"Invalid dest {dest:x}: node IDs are 32 bits")
+    for ch in channels:
+        if not 0 <= ch <= 7:
+            raise HTTPError(400, f"Invalid ch_index {ch}: channels are 0-7")
+    targets = [(f"!{dest:08x}", {"destinationId": dest, "channelIndex": 0}) for dest in dests]
+    targets += [(f"ch{ch}", {"channelIndex": ch}) for ch in channels]
+    deliveries = []
+    for radio in to_radios:
+        airtime = radio.scheduler.estimate(text)
+        for target, kwargs in targets:
+            delivery = Delivery(target, radio.name)
+            kwargs = dict(kwargs, wantAck=True, onResponse=delivery.ack_callback())
+            message = OutboundMessage(PRIO_ANNOUNCE, [text], kwargs, label=f"HTTP message to {target}", airtime=airtime)
+            message.delivery = delivery
+            if not radio.send_queue.put(message):
+                delivery.dropped("send queue full")
+            deliveries.append(delivery)
+    job_id = http_jobs.new_job(deliveries)
+    logger.info("HTTP job %d: queued %d messages: %s", job_id, len(deliveries), text)
+    return job_id, len(deliveries)
+
+def http_send(method, query, body):
+    if method == "GET":
+        # Original API: /send?sendtext=...&ch_index=N or &dest=hex
+        text = query.get('sendtext', [''])[0]
+        dests = target_list(query.get('dest'), "dest")
+        channels = target_list(query.get('ch_index'), "ch_index")
+        radio = query.get('radio', [None])[0]
+        if dests and channels:
+            dests = []  # the original API preferred ch_index when both were given
+    else:
+        text = body.get('text') or body.get('sendtext')
+        dests = target_list(body.get('dests', body.get('dest')), "dests")
+        channels = target_list(body.get('channels', body.get('ch_index')), "channels")
+        radio = body.get('radio')
+    # Sent once, from the requested radio or the first running one; /broadcast is the one that uses every radio
+    job_id, count = queue_announcements(text, dests, channels, pick_radios(radio)[:1])
+    return 202, {"job": job_id, "queued": count}
+
+def http_broadcast(method, query, body):
+    if method != "POST":
+        raise HTTPError(405, "Use POST")
+    channels = target_list(body.get('channels', [0]), "channels")
+    job_id, count = queue_announcements(body.get('text'), [], channels, pick_radios())
+    return 202, {"job": job_id, "queued": count}
+
+def http_status(method, query, body, job_id=None):
+    if job_id is None:
+        return 200, {"radios": {radio.name: radio.send_queue.snapshot() for radio in radios.values()}}
+    try:
+        status = http_jobs.status(int(job_id))
+    except ValueError:
+        status = None
+    if status is None:
+        raise HTTPError(404, f"No job {job_id}")
+    return 200, status
+
+def http_telemetry(method, query, body):
+    """/telemetry?field=channelUtilization[&group=localStats][&seconds=3600][&node=!abcd1234][&latest=1]"""
+    field = query.get('field', ['channelUtilization'])[0]
+    group = query.get('group', ['deviceMetrics'])[0]
+    if field not in TELEMETRY_FIELDS.get(group, ()):
+        raise HTTPError(400, f"Unknown telemetry field {group}.{field}")
+    seconds = float(query.get('seconds', [3600])[0])
+    node = query.get('node', [None])[0]
+    if node is not None:
+        stats = telemetry_store.node_stats(parse_dest(node), field, group, seconds)
+    else:
+        stats = telemetry_store.venue_stats(field, group, seconds, latest_only=query.get('latest', ['0'])[0] == '1')
+    return 200, {"field": f"{group}.{field}", "seconds": seconds, "node": node, "stats": stats}
+
+def http_nearby(method, query, body):
+    """/nearby?lat=..&lon=..&radius=500[&strict=1][&max_age=3600] or /nearby?bbox=lat_min,lon_min,lat_max,lon_max"""
+    max_age = float(query['max_age'][0]) if 'max_age' in query else None
+    if 'bbox' in query:
+        lat_min, lon_min, lat_max, lon_max = (float(v) for v in query['bbox'][0].split(','))
+        nodes = position_store.within_bbox(lat_min, lon_min, lat_max, lon_max, max_age)
+        return 200, {"nodes": [f"!{node_id:08x}" for node_id in nodes]}
+    if 'lat' in query and 'lon' in query:
+        lat, lon = float(query['lat'][0]), float(query['lon'][0])
+    elif BOOTH_LOCATION is not None:
+        lat, lon = BOOTH_LOCATION
+    else:
+        raise HTTPError(400, "Missing lat/lon (or bbox)")
+    radius = float(query.get('radius', [GREETING_RADIUS_M])[0])
+    nodes = position_store.nearby(lat, lon, radius, query.get('strict', ['0'])[0] == '1', max_age)
+    return 200, {"nodes": [{"node": f"!{node_id:08x}", "distance_m": distance, "uncertainty_m": uncertainty}
+                           for node_id, distance, uncertainty in nodes]}
+
+def http_links(method, query, body):
+    """/links[?node=!abcd1234][&seconds=3600]: link quality stats per node"""
+    node = query.get('node', [None])[0]
+    if node is not None:
+        stats = link_store.get(parse_dest(node))
+        if stats is None:
+            raise HTTPError(404, f"No packets heard from {node}")
+        return 200, {"node": node, "link": stats}
+    since = time.time() - float(query['seconds'][0]) if 'seconds' in query else 0
+    return 200, {"nodes": {f"!{node_id:08x}": stats for node_id, stats in link_store.export(since).items()}}
+
+def route_metrics(method, path, query, body):
+    if path.rstrip('/') != '/metrics':
+        raise HTTPError(404, "Not found")
+    return 200, metrics.render()
+
+def route_http(method, path, query, body):
+    parts = path.strip('/').split('/')
+    if parts[0] == 'send' and len(parts) == 1:
+        return http_send(method, query, body)
+    if parts[0] == 'broadcast' and len(parts) == 1:
+        return http_broadcast(method, query, body)
+    if parts[0] == 'nearby' and len(parts) == 1:
+        return http_nearby(method, query, body)
+    if parts[0] == 'telemetry' and len(parts) == 1:
+        return http_telemetry(method, query, body)
+    if parts[0] == 'links' and len(parts) == 1:
+        return http_links(method, query, body)
+    if parts[0] == 'status' and len(parts) <= 2:
+        return http_status(method, query, body, *parts[1:])
+    raise HTTPError(404, "Not found")
+
+async def handle_http_client(reader, writer, router=route_http):
+    """Serve requests on one connection until the client closes it or goes idle (HTTP/1.1 keep-alive)."""
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), HTTP_KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            if not request_line:
+                break
             try:
-                result = interface.sendText(msg, destinationId=pFrom, wantAck=True, wantResponse=True, channelIndex=0)
-                logger.info (result)
+                method, target, version = request_line.decode('latin-1').split()
+            except ValueError:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = headers.get('connection', '').lower() != 'close' and (version == 'HTTP/1.1' or headers.get('connection', '').lower() == 'keep-alive')
+
+            body_read = False
+            try:
+                length = int(headers.get('content-length', 0))
+                if length > HTTP_MAX_BODY:
+                    raise HTTPError(413, "Request body too large")
+                raw_body = await reader.readexactly(length) if length else b''
+                body_read = True
+                parsed = urllib.parse.urlsplit(target)
+                query = urllib.parse.parse_qs(parsed.query)
+                body = {}
+                if method == 'POST':
+                    if 'json' in headers.get('content-type', 'application/json'):
+                        body = json.loads(raw_body or b'{}')
+                    else:
+                        body = {k: v[0] for k, v in urllib.parse.parse_qs(raw_body.decode()).items()}
+                    if not isinstance(body, dict):
+                        raise HTTPError(400, "Body must be a JSON object")
+                elif method != 'GET':
+                    raise HTTPError(405, "Use GET or POST")
+                status, payload = router(method, parsed.path, query, body)
+            except HTTPError as e:
+                status, payload = e.status, {"error": str(e)}
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                status, payload = 400, {"error": f"Bad request: {e}"}
             except Exception as e:
-                logger.error(f"Failed to send pong: {e}")
-        else:
-            # Format timestamp to show only seconds
-            timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
-            logger.info(f"Packet is not direct message, payload: {packet['decoded']['text'] if portnum == 'TEXT_MESSAGE_APP' else payload}, ignoring")
-'''
+                logger.error("Error processing HTTP request: %s", e)
+                status, payload = 500, {"error": f"Internal server error: {e}"}
+            if not body_read:
+                keep_alive = False  # the unread body would be parsed as the next request
+
+            if isinstance(payload, str):
+                data, content_type = payload.encode(), "text/plain; version=0.0.4"
+            else:
+                data, content_type = json.dumps(payload).encode(), "application/json"
+            writer.write(f"{version if version.startswith('HTTP/') else 'HTTP/1.1'} {status} {HTTPStatus(status).phrase}\r\n"
+                         f"Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n"
+                         f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    except (ValueError, asyncio.LimitOverrunError) as e:
+        logger.debug("HTTP client sent an oversized line: %s", e)  # from readline(), past the stream limit
+    finally:
+        writer.close()
+
+async def serve_http(host=HTTP_HOST, port=HTTP_PORT, router=route_http):
+    server = await asyncio.start_server(partial(handle_http_client, router=router), host, port, reuse_address=True)
+    logger.info(f"Starting HTTP server on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+def run_http_server(host=HTTP_HOST, port=HTTP_PORT, router=route_http):
+    """Run an HTTP server on its own asyncio loop (call from a thread)."""
+    try:
+        asyncio.run(serve_http(host, port, router))
+    except OSError as e:
+        if e.errno == errno.EADDRINUSE:
+            logger.error(f"Port {port} is already in use. Please free it or choose a different port.")
+        logger.error(f"Failed to start HTTP server on {host}:{port}: {e}")
+
+def onNodeUpdated(node, interface):  # called when the NodeDB changes
+    if 'num' in node:
+        name_cache.update(node['num'], node.get('user'))
+
 def onConnection(interface, topic=pub.AUTO_TOPIC):  # called when connection is established
-    logger.info(f"Connected to radio. My node ID: {interface.myInfo.my_node_num} (0x{interface.myInfo.my_node_num:x})")
+    radio = radios.get(interface)
+    name = radio.name if radio else "radio"
+    logger.info(f"{name}: connected. My node ID: {interface.myInfo.my_node_num} (0x{interface.myInfo.my_node_num:x})")
     logger.info("Waiting for messages")
 
-# Subscribe to connection and receive events
-pub.subscribe(onReceive, "meshtastic.receive")
-pub.subscribe(onConnection, "meshtastic.connection.established")
-
-# Initialize serial interface
-try:
-    interface = meshtastic.serial_interface.SerialInterface(devPath='/dev/ttyUSB0')
-except Exception as e:
-    logger.error(f"Failed to connect to radio: {e}")
-    sys.exit(1)
-
-# Start HTTP server in a separate thread
-#http_thread = threading.Thread(target=run_http_server, daemon=True)
-#http_thread.start()
-
-try:
-    while True:
-        time.sleep(1)  # Keep the main thread running for Meshtastic events
-except KeyboardInterrupt:
-    logger.info("Shutting down...")
-    interface.close()  # Close the Meshtastic interface
-    sys.exit(0)
\ No newline at end of file
+def onConnectionLost(interface, topic=pub.AUTO_TOPIC):  # called when the serial port drops
+    radio = radios.get(interface)
+    if radio is not None:
+        radio.connection_lost(interface)
+
+def main():
+    setup_logging()
+
+    # Subscribe to connection and receive events
+    pub.subscribe(onReceive, "meshtastic.receive")
+    pub.subscribe(onConnection, "meshtastic.connection.established")
+    pub.subscribe(onConnectionLost, "meshtastic.connection.lost")
+    pub.subscribe(onNodeUpdated, "meshtastic.node.updated")
+
+    # Read the greeted-node journal while the radios connect rather than on the first greeting
+    threading.Thread(target=seen_nodes.load, name="seen-nodes-loader", daemon=True).start()
+
+    # Each radio connects (and reconnects) on its own thread, so one slow or missing radio doesn't hold up the rest
+    running = []
+    for config in RADIO_DEVICES:
+        capture_path = CAPTURE_FILE.format(radio=config["name"]) if CAPTURE_FILE else None
+        radio = Radio(config["name"], config["dev_path"], config.get("preset", LORA_PRESET), capture_path)
+        radio.start()
+        running.append(radio)
+
+    # Start HTTP server in a separate thread
+    if HTTP_ENABLED:
+        http_thread = threading.Thread(target=run_http_server, name="mesh-http", daemon=True)
+        http_thread.start()
+    if METRICS_ENABLED:
+        SEEN_NODES.set_function((), lambda: len(seen_nodes))
+        TELEMETRY_NODES.set_function((), lambda: len(telemetry_store))
+        POSITION_NODES.set_function((), lambda: len(position_store))
+        LINK_NODES.set_function((), lambda: len(link_store))
+        NAME_CACHE_LOOKUPS.set_function(("hit",), lambda: name_cache.hits)
+        NAME_CACHE_LOOKUPS.set_function(("negative_hit",), lambda: name_cache.negative_hits)
+        NAME_CACHE_LOOKUPS.set_function(("miss",), lambda: name_cache.misses)
+        if log_handler:
+            LOG_DROPPED.set_function((), lambda: log_handler.dropped)
+        metrics_thread = threading.Thread(target=run_http_server, args=(METRICS_HOST, METRICS_PORT, route_metrics), name="mesh-metrics", daemon=True)
+        metrics_thread.start()
+
+    last_status = time.monotonic()
+    try:
+        while True:
+            time.sleep(1)  # Keep the main thread running for Meshtastic events
+            seen_nodes.maybe_sync()
+            for radio in running:
+                if radio.capture:
+                    radio.capture.maybe_flush()
+            if time.monotonic() - last_status >= STATUS_INTERVAL:
+                last_status = time.monotonic()
+                for radio in running:
+                    if not radio.connected.is_set():
+                        logger.warning(f"{radio.name}: not connected to {radio.dev_path}")
+                    radio.log_status()
+                logger.info(f"Name cache: {name_cache.snapshot()}")
+                if log_handler and log_handler.dropped:
+                    logger.warning(f"Log queue overflowed, {log_handler.dropped} records dropped so far")
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+        for radio in running:
+            radio.stop()  # also closes the Meshtastic interface
+            logger.info(f"{radio.name}: send queue stats: {radio.send_queue.snapshot()}")
+        commands.shutdown()
+        seen_nodes.close()
+
+if __name__ == "__main__":
+    main()